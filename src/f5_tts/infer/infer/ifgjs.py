@@ -1,18 +1,26 @@
 # ruff: noqa: E402
 # Above allows ruff to ignore E402: module level import not at top of file
-import json
+import argparse
+import atexit
+import functools
+import os
+import queue
 import re
+import signal
+import sys
 import tempfile
+import threading
 from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from importlib.resources import files
-import os
-import click
+
 import gradio as gr
+import ijson
 import numpy as np
-import soundfile as sf
-import torchaudio
+import torch
 from cached_path import cached_path
-from transformers import AutoModelForCausalLM, AutoTokenizer
+
 
 # Create a permanent directory in the current working directory
 output_dir = os.path.join(os.getcwd(), "generated_audio")
@@ -34,73 +42,305 @@ def gpu_decorator(func):
         return func
 
 
-from f5_tts.model import DiT, UNetT
-from f5_tts.infer.utils_infer import (
-    load_vocoder,
-    load_model,
-    preprocess_ref_audio_text,
-    infer_process,
-    remove_silence_for_generated_wav,
-    save_spectrogram,
-)
+from f5_tts.infer.utils_infer import CUDAGraphVocoder
+from f5_tts.infer.utils_infer import SampleBatcher
+from f5_tts.infer.utils_infer import broadcast_sample_calls
+from f5_tts.infer.utils_infer import float_to_pcm16
+from f5_tts.infer.utils_infer import hop_length
+from f5_tts.infer.utils_infer import infer_multi_gpu
+from f5_tts.infer.utils_infer import infer_multi_process_iter
+from f5_tts.infer.utils_infer import infer_process
+from f5_tts.infer.utils_infer import infer_process_stream
+from f5_tts.infer.utils_infer import init_tensor_parallel
+from f5_tts.infer.utils_infer import load_model
+from f5_tts.infer.utils_infer import load_vocoder
+from f5_tts.infer.utils_infer import preprocess_ref_audio_text
+from f5_tts.infer.utils_infer import remove_silence_for_generated_wav_array
+from f5_tts.infer.utils_infer import shard_dit_tensor_parallel
+from f5_tts.infer.utils_infer import stop_tensor_parallel_workers
+from f5_tts.infer.utils_infer import target_sample_rate
+from f5_tts.infer.utils_infer import tensor_parallel_worker
+from f5_tts.infer.utils_infer import tensor_parallel_world_size
+from f5_tts.infer.utils_infer import transcribe
+from f5_tts.infer.utils_infer import write_wav_pcm16
+from f5_tts.model import DiT
+from f5_tts.model import UNetT
 
 
 DEFAULT_TTS_MODEL = "F5-TTS"
-tts_model_choice = DEFAULT_TTS_MODEL
+# TTS model chosen in each browser session, by session hash, so that concurrent users do not switch each other's
+tts_model_choices = {}
+
+
+def get_tts_model_choice(request):
+    """Return the TTS model chosen in the session of a gr.Request, the default one outside of a session."""
+    if request is None:
+        return DEFAULT_TTS_MODEL
+    return tts_model_choices.get(request.session_hash, DEFAULT_TTS_MODEL)
+
+
+# load models, each on first use
+
+vocoder = None
+# held while a model is loaded, so that concurrent requests (or the startup warmup) load it only once
+model_load_lock = threading.RLock()
+
+
+F5TTS_model_cfg = {"dim": 1024, "depth": 22, "heads": 16, "ff_mult": 2, "text_dim": 512, "conv_layers": 4}
+E2TTS_model_cfg = {"dim": 1024, "depth": 24, "heads": 16, "ff_mult": 4}
+
+
+def compile_tts_model(model):
+    """Compile the transformer of a loaded TTS model and warm it up, keeping it eager if compilation fails"""
+    eager_transformer = model.transformer
+    try:
+        # No CUDA graphs (reduce-overhead): with dynamic shapes they would be recorded and kept for every
+        # duration, and the sampler is called from several threads at once
+        model.transformer = torch.compile(model.transformer, dynamic=True)
+        # a few sampler steps on a typical shape (5 s reference, as much generated) so that
+        # the first request does not pay for the compilation; in inference mode as sample_mels
+        # runs, since the compiled graph is guarded on it
+        ref_audio_len = 5 * target_sample_rate
+        with torch.inference_mode():
+            model.sample(
+                cond=torch.zeros(1, ref_audio_len, device=model.device),
+                text=["Warming up the model."],
+                duration=2 * ref_audio_len // hop_length,
+                steps=2,
+                cfg_strength=2.0,
+                sway_sampling_coef=-1.0,
+                # under torchrun every rank runs this warmup on its shard, so they need the same noise
+                seed=0,
+            )
+    except Exception as e:  # noqa: BLE001 - compilation is an optimization, eager mode always works
+        print(f"Could not compile TTS model, using eager mode: {e}")
+        model.transformer = eager_transformer
+    return model
+
+
+def get_vocoder():
+    global vocoder
+    with model_load_lock:
+        if vocoder is None:
+            vocoder = load_vocoder()
+    return vocoder
+
+
+def capture_vocoder_graph(block_frames=40, context_frames=8):
+    """Replace the vocoder by one replaying a CUDA graph for the interior mel blocks streamed by infer_stream"""
+    global vocoder
+    with model_load_lock:
+        if not torch.cuda.is_available() or isinstance(get_vocoder(), CUDAGraphVocoder):
+            return
+        try:
+            vocoder = CUDAGraphVocoder(vocoder, block_frames + 2 * context_frames)
+        except Exception as e:  # noqa: BLE001 - capturing is an optimization, eager mode always works
+            print(f"Could not capture vocoder CUDA graph, using eager mode: {e}")
 
 
-# load models
+TTS_DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+# dtype of the TTS model weights, set with --dtype; by default bf16 on GPUs with bf16 tensor cores
+tts_dtype = None
 
-vocoder = load_vocoder()
 
+def get_tts_dtype():
+    """Return the dtype to load the TTS models in, None leaving it to load_checkpoint (fp16 on CUDA, else fp32)"""
+    if tts_dtype is not None:
+        return tts_dtype
+    if torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8:
+        return torch.bfloat16
+    return None
 
-def load_f5tts(ckpt_path=str(cached_path("hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors"))):
-    F5TTS_model_cfg = dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4)
-    return load_model(DiT, F5TTS_model_cfg, ckpt_path)
 
+def load_f5tts(ckpt_path=None):
+    if ckpt_path is None:
+        ckpt_path = str(cached_path("hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors"))
+    model = load_model(DiT, F5TTS_model_cfg, ckpt_path, dtype=get_tts_dtype())
+    if tensor_parallel_world_size() > 1:
+        model = shard_dit_tensor_parallel(model)
+    return compile_tts_model(model)
 
-def load_e2tts(ckpt_path=str(cached_path("hf://SWivid/E2-TTS/E2TTS_Base/model_1200000.safetensors"))):
-    E2TTS_model_cfg = dict(dim=1024, depth=24, heads=16, ff_mult=4)
-    return load_model(UNetT, E2TTS_model_cfg, ckpt_path)
 
+def load_e2tts(ckpt_path=None):
+    if ckpt_path is None:
+        ckpt_path = str(cached_path("hf://SWivid/E2-TTS/E2TTS_Base/model_1200000.safetensors"))
+    return compile_tts_model(load_model(UNetT, E2TTS_model_cfg, ckpt_path, dtype=get_tts_dtype()))
 
-def load_custom(ckpt_path: str, vocab_path="", model_cfg=None):
+
+def resolve_custom_paths(ckpt_path: str, vocab_path=""):
     ckpt_path, vocab_path = ckpt_path.strip(), vocab_path.strip()
     if ckpt_path.startswith("hf://"):
         ckpt_path = str(cached_path(ckpt_path))
     if vocab_path.startswith("hf://"):
         vocab_path = str(cached_path(vocab_path))
+    return ckpt_path, vocab_path
+
+
+def load_custom(ckpt_path: str, vocab_path="", model_cfg=None):
+    ckpt_path, vocab_path = resolve_custom_paths(ckpt_path, vocab_path)
     if model_cfg is None:
-        model_cfg = dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4)
-    return load_model(DiT, model_cfg, ckpt_path, vocab_file=vocab_path)
+        model_cfg = F5TTS_model_cfg
+    return compile_tts_model(load_model(DiT, model_cfg, ckpt_path, vocab_file=vocab_path, dtype=get_tts_dtype()))
+
+
+def tts_model_spec(model):
+    """Return (model_cls, model_cfg, ckpt_path, vocab_file) for a model choice, to load it in another process."""
+    if model == "F5-TTS":
+        return DiT, F5TTS_model_cfg, str(cached_path("hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors")), ""
+    elif model == "E2-TTS":
+        return UNetT, E2TTS_model_cfg, str(cached_path("hf://SWivid/E2-TTS/E2TTS_Base/model_1200000.safetensors")), ""
+    elif isinstance(model, list) and model[0] == "Custom":
+        return DiT, F5TTS_model_cfg, *resolve_custom_paths(model[1], vocab_path=model[2])
 
 
-F5TTS_ema_model = load_f5tts()
-E2TTS_ema_model = load_e2tts() if USING_SPACES else None
-custom_ema_model, pre_custom_path = None, ""
+F5TTS_ema_model, E2TTS_ema_model = None, None
+# Loaded custom models by (ckpt_path, vocab_path), least recently used first, to switch between them without reloading.
+# How many are kept is set with --model_cache_size, trading GPU memory for reload time
+custom_ema_models = OrderedDict()
+max_custom_ema_models = 1
+
+if USING_SPACES:
+    # ZeroGPU only hands out a GPU inside decorated calls, keep loading the official models upfront there
+    vocoder = load_vocoder()
+    F5TTS_ema_model = load_f5tts()
+    E2TTS_ema_model = load_e2tts()
 
 chat_model_state = None
 chat_tokenizer_state = None
 
 
+def load_quantized_chat_model(model_name):
+    """Load the chat model with 4-bit NF4 weights on CUDA, falling back to its native dtype without bitsandbytes"""
+    from transformers import AutoModelForCausalLM
+    from transformers import BitsAndBytesConfig
+
+    if torch.cuda.is_available():
+        quantization_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_use_double_quant=True,
+        )
+        try:
+            return AutoModelForCausalLM.from_pretrained(
+                model_name, quantization_config=quantization_config, device_map="auto"
+            )
+        except ImportError as e:
+            print(f"Could not quantize chat model, loading it unquantized: {e}")
+    return AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", device_map="auto")
+
+
+def compile_chat_model(model, tokenizer):
+    """Compile the chat model forward and warm it up, falling back to eager mode if compilation fails"""
+    if getattr(model, "is_quantized", False):
+        # bitsandbytes 4-bit layers do not trace reliably
+        return model
+    eager_forward = model.forward
+    # No CUDA graphs (reduce-overhead): the KV cache grows with each token, so they would be re-recorded
+    compiled_forward = torch.compile(model.forward, dynamic=True, fullgraph=False)
+
+    def forward(*args, **kwargs):
+        try:
+            return compiled_forward(*args, **kwargs)
+        except Exception as e:  # noqa: BLE001 - e.g. a shape first seen after the warmup that fails to compile
+            print(f"Compiled chat model failed, using eager mode: {e}")
+            model.forward = eager_forward
+            return eager_forward(*args, **kwargs)
+
+    try:
+        model.forward = forward
+        warmup_inputs = tokenizer(["Hello"], return_tensors="pt").to(model.device)
+        model.generate(**warmup_inputs, max_new_tokens=8, use_cache=True, pad_token_id=tokenizer.eos_token_id)
+    except Exception as e:  # noqa: BLE001 - compilation is an optimization, eager mode always works
+        print(f"Could not compile chat model, using eager mode: {e}")
+        model.forward = eager_forward
+    return model
+
+
+def load_chat_model(model_name):
+    """Load, quantize and compile the chat model, returning it with its tokenizer"""
+    from transformers import AutoTokenizer
+
+    model = load_quantized_chat_model(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return compile_chat_model(model, tokenizer), tokenizer
+
+
+def render_chat_suffix(tokenizer, messages, new_messages, add_generation_prompt=False):
+    """
+    Render only the part of the chat template contributed by new_messages when appended to messages.
+
+    Only the first (system) message of messages is templated, as an anchor, so the cost does not grow
+    with the history. Returns None for templates that do not render messages independently.
+    """
+    anchor = messages[:1]
+    anchor_text = tokenizer.apply_chat_template(anchor, tokenize=False)
+    text = tokenizer.apply_chat_template(
+        anchor + new_messages, tokenize=False, add_generation_prompt=add_generation_prompt
+    )
+    return text[len(anchor_text) :] if text.startswith(anchor_text) else None
+
+
+# Cache returned by generate_response for the conversation of each browser session, by session hash.
+# Dropped when the conversation is cleared or the session ends; the KV cache is not kept past
+# max_chat_cache_tokens, so one long conversation cannot hold on to an unbounded amount of GPU memory
+chat_caches = {}
+max_chat_cache_tokens = 4096
+
+
 @gpu_decorator
-def generate_response(messages, model, tokenizer):
-    """Generate response using Qwen"""
+def generate_response(messages, model, tokenizer, cache=None):
+    """
+    Generate response using Qwen.
+
+    'cache' is the value returned for the previous turn of the same conversation (or None). When the
+    messages before the last one are the ones of that turn plus its response, their rendered template is
+    reused and only the last message is templated. Its KV cache is reused for the longest token prefix
+    shared with the new prompt, so only the new tokens are encoded. That KV cache is cropped in place, so
+    'cache' must not be passed again, even if this call fails.
+    Returns the response text and the cache to pass for the next turn.
+    """
+    from transformers import DynamicCache
 
     # Converts structured messages into a formatted string for the model.
     # 'messages' is a list of {"role": ..., "content": ...} dictionaries.
     # 'tokenize=False' ensures it outputs raw text instead of tokens.
     # 'add_generation_prompt=True' appends a prompt for the model to generate its response.
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True,
-    )
+    text = None
+    if cache is not None and cache["prefix_messages"] == messages[:-1]:
+        new_text = render_chat_suffix(tokenizer, messages, messages[-1:])
+        generation_text = render_chat_suffix(tokenizer, messages, messages[-1:], add_generation_prompt=True)
+        if new_text is not None and generation_text is not None:
+            prefix_text = cache["prefix_text"] + new_text
+            text = cache["prefix_text"] + generation_text
+    if text is None:
+        prefix_text = tokenizer.apply_chat_template(messages, tokenize=False)
+        text = tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True,
+        )
 
     # Tokenizes the formatted string into tensors (numerical representation of text) for PyTorch.
     # 'return_tensors="pt"' ensures output is a PyTorch tensor.
     # '.to(model.device)' moves the tensor to the same device as the model (CPU or GPU).
     model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+    input_ids = model_inputs.input_ids
+
+    # Crops the previous turn's KV cache to the prefix it shares with the new prompt.
+    # At least one prompt token is left uncached so that generation has an input to start from.
+    past_key_values = None
+    if cache is not None:
+        cached_ids = cache["input_ids"]
+        prefix_len = min(len(cached_ids), input_ids.shape[1] - 1)
+        mismatch = (cached_ids[:prefix_len] != input_ids[0, :prefix_len]).nonzero()
+        if len(mismatch):
+            prefix_len = mismatch[0].item()
+        if prefix_len > 0:
+            past_key_values = cache["past_key_values"]
+            past_key_values.crop(prefix_len)
+    if past_key_values is None:
+        past_key_values = DynamicCache()
 
     # Generates new tokens from the model using nucleus sampling:
     # 'top_p=0.95' limits the token selection to those whose cumulative probability is >= 0.95.
@@ -109,28 +349,129 @@ def generate_response(messages, model, tokenizer):
         max_new_tokens=512,  # Generate up to 512 tokens.
         temperature=0.7,  # Controls randomness: higher = more diverse responses.
         top_p=0.95,  # Nucleus sampling: focuses on the most probable tokens.
+        past_key_values=past_key_values,  # Keys/values of the prefix already encoded in previous turns.
+        use_cache=True,
+        pad_token_id=tokenizer.eos_token_id,
     )
 
+    # The KV cache now covers every token except the last generated one.
+    cache_input_ids = generated_ids[0, : past_key_values.get_seq_length()]
+    if len(cache_input_ids) > max_chat_cache_tokens:
+        # encode the next prompt from scratch rather than keep a KV cache this long
+        cache_input_ids, past_key_values = cache_input_ids[:0], None
+
     # Removes input tokens from the output to isolate only the newly generated tokens.
     # 'zip' pairs input and output IDs, and slicing skips the original input length.
     generated_ids = [
-        output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
+        output_ids[len(input_ids) :] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
     ]
 
     # Decodes the generated tokens back into text and returns the first result.
-    return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+    response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+
+    # Rendered template of the conversation including this response, the prefix of the next turn
+    response_messages = [{"role": "assistant", "content": response}]
+    response_text = render_chat_suffix(tokenizer, messages, response_messages)
+    if response_text is None:
+        response_text = tokenizer.apply_chat_template(messages + response_messages, tokenize=False)[len(prefix_text) :]
+    cache = {
+        "input_ids": cache_input_ids,
+        "past_key_values": past_key_values,
+        "prefix_messages": messages + response_messages,
+        "prefix_text": prefix_text + response_text,
+    }
+    return response, cache
+
+
+def select_tts_model(model, show_info=gr.Info):
+    """Return the loaded TTS model for a model choice ("F5-TTS", "E2-TTS" or ["Custom", model_path, vocab_path])."""
+    global F5TTS_ema_model, E2TTS_ema_model
+    with model_load_lock:
+        if model == "F5-TTS":
+            if F5TTS_ema_model is None:
+                show_info("Loading F5-TTS model...")
+                F5TTS_ema_model = load_f5tts()
+            return F5TTS_ema_model
+        elif model == "E2-TTS":
+            if E2TTS_ema_model is None:
+                show_info("Loading E2-TTS model...")
+                E2TTS_ema_model = load_e2tts()
+            return E2TTS_ema_model
+        elif isinstance(model, list) and model[0] == "Custom":
+            assert not USING_SPACES, "Only official checkpoints allowed in Spaces."
+            custom_key = (model[1], model[2])
+            if custom_key in custom_ema_models:
+                custom_ema_models.move_to_end(custom_key)
+            else:
+                # evict before loading, not to hold one model more than the limit at once
+                if len(custom_ema_models) >= max_custom_ema_models:
+                    custom_ema_models.popitem(last=False)
+                    torch.cuda.empty_cache()
+                show_info("Loading Custom TTS model...")
+                custom_ema_models[custom_key] = load_custom(model[1], vocab_path=model[2])
+            return custom_ema_models[custom_key]
+
+
+@functools.lru_cache(maxsize=32)
+def _cached_preprocess(ref_audio_path, ref_text, mtime):
+    # mtime is only part of the key, so that an overwritten file is preprocessed again
+    return preprocess_ref_audio_text(ref_audio_path, ref_text, show_info=print)
+
+
+# Preprocessings in progress by _cached_preprocess key, so that a call made while the same reference is
+# being preprocessed (e.g. by a prefetch) waits for it instead of transcribing it again
+_preprocess_futures = {}
+_preprocess_futures_lock = threading.Lock()
+
+
+def cached_preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=gr.Info):
+    """Like preprocess_ref_audio_text, but memoized for reference audio given as a file path."""
+    if not (isinstance(ref_audio_orig, str) and os.path.isfile(ref_audio_orig)):
+        return preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
+
+    key = (ref_audio_orig, ref_text, os.path.getmtime(ref_audio_orig))
+    with _preprocess_futures_lock:
+        future = _preprocess_futures.get(key)
+        in_progress = future is not None
+        if not in_progress:
+            future = _preprocess_futures[key] = Future()
+    if not in_progress:
+        try:
+            future.set_result(_cached_preprocess(*key))
+        except Exception as e:  # noqa: BLE001 - raised again below, and in the calls waiting on it
+            future.set_exception(e)
+        finally:
+            with _preprocess_futures_lock:
+                del _preprocess_futures[key]
+    return future.result()
+
+
+preprocess_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def prefetch_preprocess_ref_audio_text(ref_audio_orig, ref_text):
+    """Start cached_preprocess_ref_audio_text in the background, so that it is cached by the time it is needed."""
+    if isinstance(ref_audio_orig, str) and os.path.isfile(ref_audio_orig):
+        preprocess_executor.submit(cached_preprocess_ref_audio_text, ref_audio_orig, ref_text, show_info=print)
 
 
 @gpu_decorator
-def infer(
-    ref_audio_orig, ref_text, gen_text, model, remove_silence, cross_fade_duration=0.15, speed=1, show_info=gr.Info
+def infer_preprocessed(
+    ref_audio,
+    ref_text,
+    gen_text,
+    model,
+    remove_silence,
+    cross_fade_duration=0.15,
+    speed=1,
+    show_info=gr.Info,
 ):
     """
     Generate speech audio using a specified TTS model and post-process the output.
 
     Args:
-        ref_audio_orig (array or file): Original reference audio input.
-        ref_text (str): Reference text corresponding to the reference audio.
+        ref_audio (str): Reference audio file, as returned by preprocess_ref_audio_text.
+        ref_text (str): Reference text, as returned by preprocess_ref_audio_text.
         gen_text (str): Target text to be converted to speech.
         model (str or list): TTS model to use. Options:
             - "F5-TTS": Use the F5-TTS model.
@@ -144,40 +485,21 @@ def infer(
     Returns:
         tuple:
             - (int, numpy.ndarray): Sample rate and waveform of the generated audio.
-            - str: Path to the saved spectrogram image.
             - str: Processed reference text.
 
     Raises:
         AssertionError: If a custom model is used in an unsupported environment.
     """
-    # Preprocess reference audio and text
-    ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
-
     # Model selection and loading
-    if model == "F5-TTS":
-        ema_model = F5TTS_ema_model
-    elif model == "E2-TTS":
-        global E2TTS_ema_model
-        if E2TTS_ema_model is None:
-            show_info("Loading E2-TTS model...")
-            E2TTS_ema_model = load_e2tts()
-        ema_model = E2TTS_ema_model
-    elif isinstance(model, list) and model[0] == "Custom":
-        assert not USING_SPACES, "Only official checkpoints allowed in Spaces."
-        global custom_ema_model, pre_custom_path
-        if pre_custom_path != model[1]:
-            show_info("Loading Custom TTS model...")
-            custom_ema_model = load_custom(model[1], vocab_path=model[2])
-            pre_custom_path = model[1]
-        ema_model = custom_ema_model
-
-    # Generate waveform, sample rate, and spectrogram
-    final_wave, final_sample_rate, combined_spectrogram = infer_process(
+    ema_model = select_tts_model(model, show_info=show_info)
+
+    # Generate waveform and sample rate
+    final_wave, final_sample_rate, _ = infer_process(
         ref_audio,
         ref_text,
         gen_text,
         ema_model,
-        vocoder,
+        get_vocoder(),
         cross_fade_duration=cross_fade_duration,
         speed=speed,
         show_info=show_info,
@@ -186,18 +508,153 @@ def infer(
 
     # Remove silence from the waveform if specified
     if remove_silence:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-            sf.write(f.name, final_wave, final_sample_rate)
-            remove_silence_for_generated_wav(f.name)
-            final_wave, _ = torchaudio.load(f.name)
-        final_wave = final_wave.squeeze().cpu().numpy()
+        final_wave = remove_silence_for_generated_wav_array(final_wave, final_sample_rate)
+
+    return (final_sample_rate, final_wave), ref_text
 
-    # Save the spectrogram as an image
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_spectrogram:
-        spectrogram_path = tmp_spectrogram.name
-        save_spectrogram(combined_spectrogram, spectrogram_path)
 
-    return (final_sample_rate, final_wave), spectrogram_path, ref_text
+# sampler passes of concurrent streams (chat replies of several users) are batched together
+tts_batcher = SampleBatcher(max_batch_size=4, max_wait=0.03)
+
+
+@gpu_decorator
+def infer_stream(ref_audio, ref_text, gen_text, model, cross_fade_duration=0.15, speed=1, show_info=gr.Info):
+    """
+    Streaming version of infer_preprocessed, without silence removal.
+
+    Synthesis and vocoding run in a background thread, so the next pieces are produced while the
+    previous ones are sent. The sampler passes go through tts_batcher.
+
+    Yields:
+        tuple: (sample rate, waveform piece) as soon as each piece is vocoded.
+    """
+    ema_model = select_tts_model(model, show_info=show_info)
+
+    pieces = queue.Queue()
+
+    def produce():
+        try:
+            for piece in infer_process_stream(
+                ref_audio,
+                ref_text,
+                gen_text,
+                ema_model,
+                get_vocoder(),
+                cross_fade_duration=cross_fade_duration,
+                speed=speed,
+                show_info=show_info,
+                batcher=tts_batcher,
+            ):
+                pieces.put(piece)
+        except Exception as e:  # noqa: BLE001 - raised again in the consumer
+            pieces.put(e)
+        finally:
+            pieces.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        piece = pieces.get()
+        if piece is None:
+            return
+        if isinstance(piece, Exception):
+            raise piece
+        yield target_sample_rate, piece
+
+
+def warmup_tts():
+    """Load and warm up the models by synthesizing a short sentence with the bundled example reference."""
+    print("Warming up TTS model...")
+    # runs in a background thread while the app serves, so a failure is reported rather than raised
+    try:
+        ref_audio, ref_text = cached_preprocess_ref_audio_text(
+            str(files("f5_tts").joinpath("infer/examples/basic/basic_ref_en.wav")),
+            "Some call me nature, others call me mother nature.",
+            show_info=print,
+        )
+        capture_vocoder_graph()
+        for _ in infer_stream(ref_audio, ref_text, "Warming up.", DEFAULT_TTS_MODEL, show_info=print):
+            pass
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+    except Exception as e:  # noqa: BLE001 - background thread, the first request loads the model instead
+        print(f"Could not warm up TTS model, it will be loaded by the first request: {e}")
+        return
+    print("TTS model warmed up.")
+
+
+@gpu_decorator
+def batched_infer_preprocessed(
+    ref_audio,
+    ref_text,
+    gen_texts,
+    model,
+    remove_silence,
+    cross_fade_duration=0.15,
+    speed=1,
+    show_info=gr.Info,
+    batch_size=4,
+):
+    """
+    Generate speech for several texts with the same reference, sharing sampler passes across them.
+
+    The reference audio and text are the ones returned by preprocess_ref_audio_text. All texts go through
+    infer_multi_process_iter, which buckets their chunks by length and samples up to batch_size chunks per pass.
+
+    Yields:
+        tuple: (index in gen_texts, (sample rate, waveform)) as soon as each text is synthesized.
+    """
+    ema_model = select_tts_model(model, show_info=show_info)
+
+    for idx, final_wave, _ in infer_multi_process_iter(
+        ref_audio,
+        ref_text,
+        gen_texts,
+        ema_model,
+        get_vocoder(),
+        cross_fade_duration=cross_fade_duration,
+        speed=speed,
+        show_info=show_info,
+        batch_size=batch_size,
+    ):
+        if remove_silence:
+            final_wave = remove_silence_for_generated_wav_array(final_wave, target_sample_rate)
+        yield idx, (target_sample_rate, final_wave)
+
+
+def wav_writer(write_queue, written_paths):
+    """Write (file_path, sample_rate, wave) items from write_queue until a None item is received."""
+    while True:
+        item = write_queue.get()
+        try:
+            if item is None:
+                return
+            file_path, sample_rate, wave = item
+            print(f"Saving audio file: {file_path}")
+            write_wav_pcm16(file_path, wave, sample_rate)
+            written_paths.append(file_path)
+        except Exception as e:  # noqa: BLE001 - the writer thread must keep draining the queue
+            print(f"Error saving {item[0]}: {e}")
+        finally:
+            write_queue.task_done()
+
+
+def compression_middleware(compress):
+    """Return the Starlette middleware compressing the app responses: none, gzip, or br (with gzip fallback)"""
+    from starlette.middleware import Middleware
+
+    if compress == "br":
+        try:
+            from brotli_asgi import BrotliMiddleware
+
+            return [Middleware(BrotliMiddleware, minimum_size=1024)]
+        except ImportError:
+            print("brotli-asgi is not installed, compressing with gzip instead")
+            compress = "gzip"
+    if compress == "gzip":
+        from starlette.middleware.gzip import GZipMiddleware
+
+        return [Middleware(GZipMiddleware, minimum_size=1024)]
+    return []
 
 
 with gr.Blocks() as app_credits:
@@ -219,39 +676,51 @@ with gr.Blocks() as app_tts:
     generate_btn = gr.Button("Synthesize All Chapters", variant="primary")
     output_files_output = gr.Textbox(label="Generated Audio Files")
 
-    # Global variable to hold chapter data
-    chapter_list = []
+    # Chapters parsed from the uploaded JSON file, per session
+    chapter_list_state = gr.State([])
+
+    # Set to True to log every loaded chapter
+    DEBUG = False
+    # Number of chapters shown in the preview textbox
+    max_preview_chapters = 50
 
     # Function to process the uploaded JSON file
     def process_json_file(json_file):
-        global chapter_list
-        chapter_list = []  # Reset chapter list
+        chapter_list = []
         try:
             print(f"Processing JSON file: {json_file.name}")
-            with open(json_file.name, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-            print("Successfully loaded JSON file.")
-
-            chapters = data.get("chapters", {})
-            if not chapters:
+            # Stream the "chapters" object instead of loading the whole file
+            with open(json_file.name, "rb") as file:
+                for title, content in ijson.kvitems(file, "chapters"):
+                    chapter_list.append(f"{title} {content}")
+                    if DEBUG:
+                        print(f"Loaded Chapter: {title[:20]}...")
+
+            if not chapter_list:
                 print("No chapters found in JSON file.")
-                return "Error: No chapters found."
+                return "Error: No chapters found.", chapter_list
 
-            for title, content in chapters.items():
-                paragraph = f"{title} {content}"
-                chapter_list.append(paragraph)
-                print(f"Loaded Chapter: {title[:20]}...")  # DEBUG
-
-            print("All chapters loaded successfully.")
-            return "\n".join(chapter_list)
+            print(f"All {len(chapter_list)} chapters loaded successfully.")
+            preview = "\n".join(chapter_list[:max_preview_chapters])
+            if len(chapter_list) > max_preview_chapters:
+                preview += f"\n... ({len(chapter_list) - max_preview_chapters} more chapters)"
+            return preview, chapter_list
         except Exception as e:
             print(f"Error processing JSON file: {e}")
-            return f"Error: {e}"
-
+            return f"Error: {e}", []
 
     @gpu_decorator
-    def batch_tts_synthesize(ref_audio_input, ref_text_input, remove_silence, cross_fade_duration_slider, speed_slider):
+    def batch_tts_synthesize(
+        chapter_list,
+        ref_audio_input,
+        ref_text_input,
+        remove_silence,
+        cross_fade_duration_slider,
+        speed_slider,
+        request: gr.Request,
+    ):
         print("Starting Batch Synthesis...")  # DEBUG
+        tts_model_choice = get_tts_model_choice(request)
         print(f"Reference Audio: {ref_audio_input}")
         print(f"Reference Text: {ref_text_input}")
         print(f"Cross-Fade Duration: {cross_fade_duration_slider}, Speed: {speed_slider}")
@@ -260,45 +729,100 @@ with gr.Blocks() as app_tts:
             print("No chapters to process. Ensure JSON is uploaded and parsed.")
             return "Error: No chapters available for synthesis."
 
-        file_paths = []
-        for idx, chapter_text in enumerate(chapter_list):
-            print(f"Processing Chapter {idx + 1}/{len(chapter_list)}: {chapter_text[:50]}...")  # DEBUG
+        # Each run writes its chapters into its own directory, so that concurrent runs do not overwrite each other
+        run_dir = tempfile.mkdtemp(prefix="batch_", dir=output_dir)
+
+        if not USING_SPACES and torch.cuda.device_count() > 1 and tensor_parallel_world_size() == 1:
+            # one worker process per GPU, each writing its own share of the chapters; the one on GPU 0 loads
+            # a second copy of the model next to the one of this app
+            file_paths = [os.path.join(run_dir, f"chapter_{idx + 1}.wav") for idx in range(len(chapter_list))]
             try:
-                audio_out, _, _ = infer(
-                    ref_audio_input,
-                    ref_text_input,
-                    chapter_text,
-                    tts_model_choice,
-                    remove_silence,
-                    cross_fade_duration_slider,
-                    speed_slider,
-                    show_info=print,
+                ref_audio, ref_text = cached_preprocess_ref_audio_text(ref_audio_input, ref_text_input, show_info=print)
+                infer_multi_gpu(
+                    ref_audio,
+                    ref_text,
+                    chapter_list,
+                    tts_model_spec(tts_model_choice),
+                    file_paths,
+                    dtype=get_tts_dtype(),
+                    compile_model=True,
+                    remove_silence=remove_silence,
+                    cross_fade_duration=cross_fade_duration_slider,
+                    speed=speed_slider,
                 )
+            except Exception as e:  # noqa: BLE001 - reported to the user as the result
+                print(f"Error processing chapters: {e}")
+            # the chapters written before a failure are still returned
+            file_paths = [file_path for file_path in file_paths if os.path.exists(file_path)]
+            print("Batch Synthesis Completed.")
+            print(f"Generated Files: {file_paths}")
+            return "\n".join(file_paths)
 
-                file_name = f"chapter_{idx + 1}.wav"
-                file_path = os.path.join(output_dir, file_name)
-                print(f"Saving audio file: {file_path}")
-                sf.write(file_path, audio_out[1], audio_out[0])
-                file_paths.append(file_path)
-            except Exception as e:
-                print(f"Error processing Chapter {idx + 1}: {e}")
+        try:
+            ref_audio, ref_text = cached_preprocess_ref_audio_text(ref_audio_input, ref_text_input, show_info=print)
+        except Exception as e:  # noqa: BLE001 - reported to the user as the result
+            print(f"Error processing reference audio: {e}")
+            return f"Error: {e}"
+
+        # Chapter files are written by a background thread while the next chapters are synthesized
+        chapter_paths = [os.path.join(run_dir, f"chapter_{idx + 1}.wav") for idx in range(len(chapter_list))]
+        written_paths = []
+        write_queue = queue.Queue(maxsize=2)
+        writer = threading.Thread(target=wav_writer, args=(write_queue, written_paths), daemon=True)
+        writer.start()
+        synthesized = set()
+
+        def synthesize(indices):
+            # chapters are bucketed by length and synthesized in batches, and handed over as they complete
+            for i, (sample_rate, wave) in batched_infer_preprocessed(
+                ref_audio,
+                ref_text,
+                [chapter_list[idx] for idx in indices],
+                tts_model_choice,
+                remove_silence,
+                cross_fade_duration_slider,
+                speed_slider,
+                show_info=print,
+            ):
+                write_queue.put((chapter_paths[indices[i]], sample_rate, wave))
+                synthesized.add(indices[i])
 
+        try:
+            try:
+                synthesize(list(range(len(chapter_list))))
+            except Exception as e:  # noqa: BLE001 - retried below, one chapter at a time
+                # one chapter failing should not cost the others: the rest are retried one by one and
+                # those failing again are skipped
+                print(f"Error processing chapters in batches, retrying the remaining ones one at a time: {e}")
+                for idx in range(len(chapter_list)):
+                    if idx in synthesized:
+                        continue
+                    print(f"Processing Chapter {idx + 1}/{len(chapter_list)}: {chapter_list[idx][:50]}...")  # DEBUG
+                    try:
+                        synthesize([idx])
+                    except Exception as e:
+                        print(f"Error processing Chapter {idx + 1}: {e}")
+        finally:
+            write_queue.put(None)
+            write_queue.join()
+
+        file_paths = [file_path for file_path in chapter_paths if file_path in written_paths]
         print("Batch Synthesis Completed.")
         print(f"Generated Files: {file_paths}")
         return "\n".join(file_paths)
 
-
     # Button to process JSON file
     process_json_btn.click(
         process_json_file,
         inputs=[json_file_input],
-        outputs=[chapter_list_output],
+        outputs=[chapter_list_output, chapter_list_state],
     )
 
-    # Button to synthesize all chapters sequentially
+    # Button to synthesize all chapters in batches
     generate_btn.click(
         batch_tts_synthesize,
         inputs=[
+            chapter_list_state,
             gr.Audio(label="Reference Audio", type="filepath"),
             gr.Textbox(label="Reference Text", lines=2),
             gr.Checkbox(label="Remove Silences", value=False),
@@ -308,29 +832,32 @@ with gr.Blocks() as app_tts:
         outputs=[output_files_output],
     )
 
-def parse_speechtypes_text(gen_text):
-    # Pattern to find {speechtype}
-    pattern = r"\{(.*?)\}"
+# Pattern to find {speechtype}
+_STYLE_RE = re.compile(r"\{([^}]*)\}")
 
-    # Split the text by the pattern
-    tokens = re.split(pattern, gen_text)
 
+@functools.lru_cache(maxsize=64)
+def parse_speechtypes_text(gen_text):
+    """Split gen_text into a tuple of (style, text) segments, text following a {style} label using that style."""
     segments = []
 
     current_style = "Regular"
+    last_end = 0
 
-    for i in range(len(tokens)):
-        if i % 2 == 0:
-            # This is text
-            text = tokens[i].strip()
-            if text:
-                segments.append({"style": current_style, "text": text})
-        else:
-            # This is style
-            style = tokens[i].strip()
-            current_style = style
+    for match in _STYLE_RE.finditer(gen_text):
+        # This is text
+        text = gen_text[last_end : match.start()].strip()
+        if text:
+            segments.append((current_style, text))
+        # This is style
+        current_style = match.group(1).strip()
+        last_end = match.end()
+
+    text = gen_text[last_end:].strip()
+    if text:
+        segments.append((current_style, text))
 
-    return segments
+    return tuple(segments)
 
 
 with gr.Blocks() as app_multistyle:
@@ -370,111 +897,122 @@ with gr.Blocks() as app_multistyle:
         "Upload different audio clips for each speech type. The first speech type is mandatory. You can add additional speech types by clicking the 'Add Speech Type' button."
     )
 
-    # Regular speech type (mandatory)
-    with gr.Row():
-        with gr.Column():
-            regular_name = gr.Textbox(value="Regular", label="Speech Type Name")
-            regular_insert = gr.Button("Insert Label", variant="secondary")
-        regular_audio = gr.Audio(label="Regular Reference Audio", type="filepath")
-        regular_ref_text = gr.Textbox(label="Reference Text (Regular)", lines=2)
-
-    # Regular speech type (max 100)
-    max_speech_types = 100
-    speech_type_rows = []  # 99
-    speech_type_names = [regular_name]  # 100
-    speech_type_audios = [regular_audio]  # 100
-    speech_type_ref_texts = [regular_ref_text]  # 100
-    speech_type_delete_btns = []  # 99
-    speech_type_insert_btns = [regular_insert]  # 100
-
-    # Additional speech types (99 more)
-    for i in range(max_speech_types - 1):
-        with gr.Row(visible=False) as row:
-            with gr.Column():
-                name_input = gr.Textbox(label="Speech Type Name")
-                delete_btn = gr.Button("Delete Type", variant="secondary")
-                insert_btn = gr.Button("Insert Label", variant="secondary")
-            audio_input = gr.Audio(label="Reference Audio", type="filepath")
-            ref_text_input = gr.Textbox(label="Reference Text", lines=2)
-        speech_type_rows.append(row)
-        speech_type_names.append(name_input)
-        speech_type_audios.append(audio_input)
-        speech_type_ref_texts.append(ref_text_input)
-        speech_type_delete_btns.append(delete_btn)
-        speech_type_insert_btns.append(insert_btn)
+    # Speech types declared in the UI, one dict per row. Only these rows are rendered,
+    # the first one being the mandatory regular speech type.
+    max_speech_types = 12
+    speech_types_state = gr.State(value=[{"id": 0, "name": "Regular", "audio": None, "ref_text": ""}])
+    # Bumped whenever rows are added, deleted or updated from the backend, to re-render them
+    speech_types_version = gr.State(value=0)
+    # Names of the declared speech types, kept in sync by the name and delete handlers
+    speech_type_names_state = gr.State(value={"Regular"})
 
-    # Button to add speech type
-    add_speech_type_btn = gr.Button("Add Speech Type")
+    # Text input for the prompt
+    gen_text_input_multistyle = gr.Textbox(
+        label="Text to Generate",
+        lines=10,
+        placeholder="Enter the script with speaker names (or emotion types) at the start of each block, e.g.:\n\n{Regular} Hello, I'd like to order a sandwich please.\n{Surprised} What do you mean you're out of bread?\n{Sad} I really wanted a sandwich though...\n{Angry} You know what, darn you and your little shop!\n{Whisper} I'll just go back home and cry now.\n{Shouting} Why me?!",
+        render=False,
+    )
 
-    # Keep track of current number of speech types
-    speech_type_count = gr.State(value=1)
+    # Function to update a field of a speech type from its component
+    def make_update_speech_type_fn(type_id, key):
+        def update_speech_type_fn(value, speech_types):
+            for speech_type in speech_types:
+                if speech_type["id"] == type_id:
+                    speech_type[key] = value
+            return speech_types
 
-    # Function to add a speech type
-    def add_speech_type_fn(speech_type_count):
-        if speech_type_count < max_speech_types:
-            speech_type_count += 1
-            # Prepare updates for the rows
-            row_updates = []
-            for i in range(1, max_speech_types):
-                if i < speech_type_count:
-                    row_updates.append(gr.update(visible=True))
-                else:
-                    row_updates.append(gr.update())
-        else:
-            # Optionally, show a warning
-            row_updates = [gr.update() for _ in range(1, max_speech_types)]
-        return [speech_type_count] + row_updates
+        return update_speech_type_fn
 
-    add_speech_type_btn.click(
-        add_speech_type_fn, inputs=speech_type_count, outputs=[speech_type_count] + speech_type_rows
-    )
+    def speech_type_names(speech_types):
+        return {speech_type["name"] for speech_type in speech_types if speech_type["name"]}
 
-    # Function to delete a speech type
-    def make_delete_speech_type_fn(index):
-        def delete_speech_type_fn(speech_type_count):
-            # Prepare updates
-            row_updates = []
-
-            for i in range(1, max_speech_types):
-                if i == index:
-                    row_updates.append(gr.update(visible=False))
-                else:
-                    row_updates.append(gr.update())
+    # Function to rename a speech type, refreshing the set of declared names
+    def make_rename_speech_type_fn(type_id):
+        update_speech_type_fn = make_update_speech_type_fn(type_id, "name")
 
-            speech_type_count = max(1, speech_type_count)
+        def rename_speech_type_fn(value, speech_types):
+            speech_types = update_speech_type_fn(value, speech_types)
+            return speech_types, speech_type_names(speech_types)
 
-            return [speech_type_count] + row_updates
+        return rename_speech_type_fn
+
+    # Function to delete a speech type
+    def make_delete_speech_type_fn(type_id):
+        def delete_speech_type_fn(speech_types, version):
+            speech_types = [speech_type for speech_type in speech_types if speech_type["id"] != type_id]
+            return speech_types, version + 1, speech_type_names(speech_types)
 
         return delete_speech_type_fn
 
-    # Update delete button clicks
-    for i, delete_btn in enumerate(speech_type_delete_btns):
-        delete_fn = make_delete_speech_type_fn(i)
-        delete_btn.click(delete_fn, inputs=speech_type_count, outputs=[speech_type_count] + speech_type_rows)
+    def insert_speech_type_fn(current_text, speech_type_name):
+        current_text = current_text or ""
+        speech_type_name = speech_type_name or "None"
+        updated_text = current_text + f"{{{speech_type_name}}} "
+        return gr.update(value=updated_text)
+
+    @gr.render(inputs=speech_types_state, triggers=[app_multistyle.load, speech_types_version.change])
+    def render_speech_types(speech_types):
+        for index, speech_type in enumerate(speech_types):
+            with gr.Row():
+                with gr.Column():
+                    name_input = gr.Textbox(value=speech_type["name"], label="Speech Type Name")
+                    if index > 0:
+                        delete_btn = gr.Button("Delete Type", variant="secondary")
+                    insert_btn = gr.Button("Insert Label", variant="secondary")
+                if index == 0:
+                    audio_input = gr.Audio(value=speech_type["audio"], label="Regular Reference Audio", type="filepath")
+                    ref_text_input = gr.Textbox(
+                        value=speech_type["ref_text"], label="Reference Text (Regular)", lines=2
+                    )
+                else:
+                    audio_input = gr.Audio(value=speech_type["audio"], label="Reference Audio", type="filepath")
+                    ref_text_input = gr.Textbox(value=speech_type["ref_text"], label="Reference Text", lines=2)
+
+            name_input.change(
+                make_rename_speech_type_fn(speech_type["id"]),
+                inputs=[name_input, speech_types_state],
+                outputs=[speech_types_state, speech_type_names_state],
+                show_progress="hidden",
+            )
+            for component, key in [(audio_input, "audio"), (ref_text_input, "ref_text")]:
+                component.change(
+                    make_update_speech_type_fn(speech_type["id"], key),
+                    inputs=[component, speech_types_state],
+                    outputs=speech_types_state,
+                    show_progress="hidden",
+                )
+            if index > 0:
+                delete_btn.click(
+                    make_delete_speech_type_fn(speech_type["id"]),
+                    inputs=[speech_types_state, speech_types_version],
+                    outputs=[speech_types_state, speech_types_version, speech_type_names_state],
+                )
+            insert_btn.click(
+                insert_speech_type_fn,
+                inputs=[gen_text_input_multistyle, name_input],
+                outputs=gen_text_input_multistyle,
+            )
 
-    # Text input for the prompt
-    gen_text_input_multistyle = gr.Textbox(
-        label="Text to Generate",
-        lines=10,
-        placeholder="Enter the script with speaker names (or emotion types) at the start of each block, e.g.:\n\n{Regular} Hello, I'd like to order a sandwich please.\n{Surprised} What do you mean you're out of bread?\n{Sad} I really wanted a sandwich though...\n{Angry} You know what, darn you and your little shop!\n{Whisper} I'll just go back home and cry now.\n{Shouting} Why me?!",
+    # Button to add speech type
+    add_speech_type_btn = gr.Button("Add Speech Type")
+
+    # Function to add a speech type
+    def add_speech_type_fn(speech_types, version):
+        if len(speech_types) >= max_speech_types:
+            gr.Warning(f"At most {max_speech_types} speech types are supported.")
+            return speech_types, version
+        next_id = max(speech_type["id"] for speech_type in speech_types) + 1
+        speech_types = speech_types + [{"id": next_id, "name": "", "audio": None, "ref_text": ""}]
+        return speech_types, version + 1
+
+    add_speech_type_btn.click(
+        add_speech_type_fn,
+        inputs=[speech_types_state, speech_types_version],
+        outputs=[speech_types_state, speech_types_version],
     )
 
-    def make_insert_speech_type_fn(index):
-        def insert_speech_type_fn(current_text, speech_type_name):
-            current_text = current_text or ""
-            speech_type_name = speech_type_name or "None"
-            updated_text = current_text + f"{{{speech_type_name}}} "
-            return gr.update(value=updated_text)
-
-        return insert_speech_type_fn
-
-    for i, insert_btn in enumerate(speech_type_insert_btns):
-        insert_fn = make_insert_speech_type_fn(i)
-        insert_btn.click(
-            insert_fn,
-            inputs=[gen_text_input_multistyle, speech_type_names[i]],
-            outputs=gen_text_input_multistyle,
-        )
+    gen_text_input_multistyle.render()
 
     with gr.Accordion("Advanced Settings", open=False):
         remove_silence_multistyle = gr.Checkbox(
@@ -489,110 +1027,96 @@ with gr.Blocks() as app_multistyle:
     audio_output_multistyle = gr.Audio(label="Synthesized Audio")
 
     @gpu_decorator
-    def generate_multistyle_speech(
-        gen_text,
-        *args,
-    ):
-        speech_type_names_list = args[:max_speech_types]
-        speech_type_audios_list = args[max_speech_types : 2 * max_speech_types]
-        speech_type_ref_texts_list = args[2 * max_speech_types : 3 * max_speech_types]
-        remove_silence = args[3 * max_speech_types]
+    def generate_multistyle_speech(gen_text, speech_types_list, remove_silence, version, request: gr.Request):
+        tts_model_choice = get_tts_model_choice(request)
         # Collect the speech types and their audios into a dict
         speech_types = OrderedDict()
 
-        ref_text_idx = 0
-        for name_input, audio_input, ref_text_input in zip(
-            speech_type_names_list, speech_type_audios_list, speech_type_ref_texts_list
-        ):
-            if name_input and audio_input:
-                speech_types[name_input] = {"audio": audio_input, "ref_text": ref_text_input}
-            else:
-                speech_types[f"@{ref_text_idx}@"] = {"audio": "", "ref_text": ""}
-            ref_text_idx += 1
+        for speech_type in speech_types_list:
+            if speech_type["name"] and speech_type["audio"]:
+                speech_types[speech_type["name"]] = {
+                    "audio": speech_type["audio"],
+                    "ref_text": speech_type["ref_text"],
+                }
 
         # Parse the gen_text into segments
         segments = parse_speechtypes_text(gen_text)
 
-        # For each segment, generate speech
-        generated_audio_segments = []
-        current_style = "Regular"
-
-        for segment in segments:
-            style = segment["style"]
-            text = segment["text"]
-
-            if style in speech_types:
-                current_style = style
-            else:
-                # If style not available, default to Regular
-                current_style = "Regular"
-
-            ref_audio = speech_types[current_style]["audio"]
-            ref_text = speech_types[current_style].get("ref_text", "")
-
-            # Generate speech for this segment
-            audio_out, _, ref_text_out = infer(
-                ref_audio, ref_text, text, tts_model_choice, remove_silence, 0, show_info=print
-            )  # show_info=print no pull to top when generating
-            sr, audio_data = audio_out
-
-            generated_audio_segments.append(audio_data)
-            speech_types[current_style]["ref_text"] = ref_text_out
+        # Group the segments by speech type, keeping their position in the script
+        style_segments = OrderedDict()
+        for idx, (style, text) in enumerate(segments):
+            # If style not available, default to Regular
+            current_style = style if style in speech_types else "Regular"
+            style_segments.setdefault(current_style, []).append((idx, text))
+
+        # For each speech type, preprocess its reference once and generate its segments in batches
+        generated_audio_segments = [None] * len(segments)
+        for current_style, style_texts in style_segments.items():
+            ref_audio, ref_text = cached_preprocess_ref_audio_text(
+                speech_types[current_style]["audio"],
+                speech_types[current_style].get("ref_text", ""),
+                show_info=print,
+            )
+            for text_idx, (sr, audio_data) in batched_infer_preprocessed(
+                ref_audio,
+                ref_text,
+                [text for _, text in style_texts],
+                tts_model_choice,
+                remove_silence,
+                0,
+                show_info=print,  # show_info=print no pull to top when generating
+            ):
+                generated_audio_segments[style_texts[text_idx][0]] = audio_data
+            speech_types[current_style]["ref_text"] = ref_text
+        total_len = sum(len(audio_data) for audio_data in generated_audio_segments)
 
         # Concatenate all audio segments
         if generated_audio_segments:
-            final_audio_data = np.concatenate(generated_audio_segments)
-            return [(sr, final_audio_data)] + [
-                gr.update(value=speech_types[style]["ref_text"]) for style in speech_types
-            ]
+            # Fill a single pre-sized buffer, releasing each segment once it is copied
+            final_audio_data = np.empty(total_len, dtype=np.float32)
+            offset = 0
+            for i, audio_data in enumerate(generated_audio_segments):
+                final_audio_data[offset : offset + len(audio_data)] = audio_data
+                offset += len(audio_data)
+                generated_audio_segments[i] = None
+            generated_audio_segments.clear()
+            audio_output = (sr, final_audio_data)
         else:
             gr.Warning("No audio generated.")
-            return [None] + [gr.update(value=speech_types[style]["ref_text"]) for style in speech_types]
+            audio_output = None
+
+        # Write back the (possibly transcribed) reference texts and re-render the rows with them
+        for speech_type in speech_types_list:
+            if speech_type["name"] in speech_types:
+                speech_type["ref_text"] = speech_types[speech_type["name"]]["ref_text"]
+        return audio_output, speech_types_list, version + 1
 
     generate_multistyle_btn.click(
         generate_multistyle_speech,
-        inputs=[
-            gen_text_input_multistyle,
-        ]
-        + speech_type_names
-        + speech_type_audios
-        + speech_type_ref_texts
-        + [
-            remove_silence_multistyle,
-        ],
-        outputs=[audio_output_multistyle] + speech_type_ref_texts,
+        inputs=[gen_text_input_multistyle, speech_types_state, remove_silence_multistyle, speech_types_version],
+        outputs=[audio_output_multistyle, speech_types_state, speech_types_version],
     )
 
     # Validation function to disable Generate button if speech types are missing
-    def validate_speech_types(gen_text, regular_name, *args):
-        speech_type_names_list = args[:max_speech_types]
-
-        # Collect the speech types names
-        speech_types_available = set()
-        if regular_name:
-            speech_types_available.add(regular_name)
-        for name_input in speech_type_names_list:
-            if name_input:
-                speech_types_available.add(name_input)
-
+    def validate_speech_types(gen_text, speech_types_available):
         # Parse the gen_text to get the speech types used
-        segments = parse_speechtypes_text(gen_text)
-        speech_types_in_text = set(segment["style"] for segment in segments)
+        speech_types_in_text = {style for style, _ in parse_speechtypes_text(gen_text)}
 
         # Check if all speech types in text are available
-        missing_speech_types = speech_types_in_text - speech_types_available
-
-        if missing_speech_types:
+        if not speech_types_in_text <= speech_types_available:
             # Disable the generate button
             return gr.update(interactive=False)
         else:
             # Enable the generate button
             return gr.update(interactive=True)
 
-    gen_text_input_multistyle.change(
+    # Validated when the script loses focus rather than on every keystroke; speech types still missing
+    # when generating fall back to Regular in generate_multistyle_speech
+    gen_text_input_multistyle.blur(
         validate_speech_types,
-        inputs=[gen_text_input_multistyle, regular_name] + speech_type_names,
+        inputs=[gen_text_input_multistyle, speech_type_names_state],
         outputs=generate_multistyle_btn,
+        show_progress="hidden",
     )
 
 
@@ -614,29 +1138,25 @@ Have a conversation with an AI using your reference voice!
         chat_interface_container = gr.Column(visible=False)
 
         @gpu_decorator
-        def load_chat_model():
+        def load_chat_model_fn():
             global chat_model_state, chat_tokenizer_state
             if chat_model_state is None:
                 show_info = gr.Info
                 show_info("Loading chat model...")
                 model_name = "Qwen/Qwen2.5-3B-Instruct"
-                chat_model_state = AutoModelForCausalLM.from_pretrained(
-                    model_name, torch_dtype="auto", device_map="auto"
-                )
-                chat_tokenizer_state = AutoTokenizer.from_pretrained(model_name)
+                chat_model_state, chat_tokenizer_state = load_chat_model(model_name)
                 show_info("Chat model loaded.")
 
             return gr.update(visible=False), gr.update(visible=True)
 
-        load_chat_model_btn.click(load_chat_model, outputs=[load_chat_model_btn, chat_interface_container])
+        load_chat_model_btn.click(load_chat_model_fn, outputs=[load_chat_model_btn, chat_interface_container])
 
     else:
         chat_interface_container = gr.Column()
 
         if chat_model_state is None:
             model_name = "Qwen/Qwen2.5-3B-Instruct"
-            chat_model_state = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", device_map="auto")
-            chat_tokenizer_state = AutoTokenizer.from_pretrained(model_name)
+            chat_model_state, chat_tokenizer_state = load_chat_model(model_name)
 
     with chat_interface_container:
         with gr.Row():
@@ -644,9 +1164,10 @@ Have a conversation with an AI using your reference voice!
                 ref_audio_chat = gr.Audio(label="Reference Audio", type="filepath")
             with gr.Column():
                 with gr.Accordion("Advanced Settings", open=False):
+                    # off by default: silences can only be removed from the whole reply, which is then not streamed
                     remove_silence_chat = gr.Checkbox(
                         label="Remove Silences",
-                        value=True,
+                        value=False,
                     )
                     ref_text_chat = gr.Textbox(
                         label="Reference Text",
@@ -663,11 +1184,14 @@ Have a conversation with an AI using your reference voice!
 
         with gr.Row():
             with gr.Column():
+                # Recorded at Whisper's 16 kHz and passed as samples, without a temporary WAV file to write and decode
                 audio_input_chat = gr.Microphone(
                     label="Speak your message",
-                    type="filepath",
+                    type="numpy",
+                    format="wav",
+                    waveform_options=gr.WaveformOptions(sample_rate=16000),
                 )
-                audio_output_chat = gr.Audio(autoplay=True)
+                audio_output_chat = gr.Audio(type="numpy", format="wav", autoplay=True, streaming=True)
             with gr.Column():
                 text_input_chat = gr.Textbox(
                     label="Type your message",
@@ -687,127 +1211,141 @@ Have a conversation with an AI using your reference voice!
 
         # Modify process_audio_input to use model and tokenizer from state
         @gpu_decorator
-        def process_audio_input(audio_path, text, history, conv_state):
+        def process_audio_input(
+            audio_input, text, history, conv_state, system_prompt, ref_audio, ref_text, request: gr.Request
+        ):
             print("Processing User Input...")  # DEBUG
-            if audio_path:
-                print(f"Audio Input Path: {audio_path}")
+            if audio_input is not None:
+                print(f"Audio Input: {len(audio_input[1]) / audio_input[0]:.2f}s at {audio_input[0]} Hz")
             if text:
                 print(f"User Text Input: {text}")
 
-            if not audio_path and not text.strip():
+            if audio_input is None and not text.strip():
                 print("No input provided.")
-                return history, conv_state, ""
+                return history, conv_state
+
+            # The system prompt is applied as the message is sent rather than on every edit of the prompt;
+            # the history is kept, it is only reset by clearing the conversation
+            conv_state[0] = {"role": "system", "content": system_prompt}
+
+            # The reference for the spoken response is preprocessed while the input is transcribed and answered
+            if ref_audio:
+                prefetch_preprocess_ref_audio_text(ref_audio, ref_text or "")
 
             try:
-                if audio_path:
-                    text = preprocess_ref_audio_text(audio_path, text)[1]
+                if audio_input is not None and not text.strip():
+                    # The message itself is wanted as is, not trimmed and clipped like a reference audio
+                    sr, samples = audio_input
+                    samples = np.asarray(samples, dtype=np.float32)
+                    if np.issubdtype(audio_input[1].dtype, np.integer):
+                        samples /= 32768.0
+                    if samples.ndim > 1:
+                        samples = samples.mean(axis=1)
+                    text = transcribe({"raw": samples, "sampling_rate": sr})
                     print(f"Transcribed Text: {text}")
 
                 conv_state.append({"role": "user", "content": text})
                 history.append((text, None))
 
                 print("Generating AI Response...")
-                response = generate_response(conv_state, chat_model_state, chat_tokenizer_state)
+                # taken out until the response is generated, so that a failed turn does not leave a cropped cache
+                cache = chat_caches.pop(request.session_hash, None)
+                response, chat_caches[request.session_hash] = generate_response(
+                    conv_state, chat_model_state, chat_tokenizer_state, cache=cache
+                )
                 print(f"AI Response: {response}")
 
                 conv_state.append({"role": "assistant", "content": response})
                 history[-1] = (text, response)
-                return history, conv_state, ""
+                return history, conv_state
             except Exception as e:
                 print(f"Error processing input: {e}")
-                return history, conv_state, ""
-
+                return history, conv_state
 
         @gpu_decorator
-        def generate_audio_response(history, ref_audio, ref_text, remove_silence):
-            """Generate TTS audio for AI response"""
+        def generate_audio_response(history, ref_audio, ref_text, remove_silence, request: gr.Request):
+            """Generate TTS audio for AI response, streamed as it is synthesized"""
+            tts_model_choice = get_tts_model_choice(request)
             if not history or not ref_audio:
-                return None
+                yield None, gr.update()
+                return
 
-            last_user_message, last_ai_response = history[-1]
+            _, last_ai_response = history[-1]
             if not last_ai_response:
-                return None
+                yield None, gr.update()
+                return
+
+            ref_audio, ref_text_out = cached_preprocess_ref_audio_text(ref_audio, ref_text, show_info=print)
 
-            audio_result, _, ref_text_out = infer(
+            if remove_silence:
+                # silences can only be found on the whole waveform
+                audio_result, _ = infer_preprocessed(
+                    ref_audio,
+                    ref_text_out,
+                    last_ai_response,
+                    tts_model_choice,
+                    remove_silence,
+                    cross_fade_duration=0.15,
+                    speed=1.0,
+                    show_info=print,  # show_info=print no pull to top when generating
+                )
+                sr, audio_data = audio_result
+                yield (sr, float_to_pcm16(audio_data)), gr.update(value=ref_text_out)
+                return
+
+            for audio_chunk in infer_stream(
                 ref_audio,
-                ref_text,
+                ref_text_out,
                 last_ai_response,
                 tts_model_choice,
-                remove_silence,
                 cross_fade_duration=0.15,
                 speed=1.0,
-                show_info=print,  # show_info=print no pull to top when generating
-            )
-            return audio_result, gr.update(value=ref_text_out)
-
-        def clear_conversation():
-            """Reset the conversation"""
-            return [], [
-                {
-                    "role": "system",
-                    "content": "You are not an AI assistant, you are whoever the user says you are. You must stay in character. Keep your responses concise since they will be spoken out loud.",
-                }
-            ]
-
-        def update_system_prompt(new_prompt):
-            """Update the system prompt and reset the conversation"""
-            new_conv_state = [{"role": "system", "content": new_prompt}]
-            return [], new_conv_state
-
-        # Handle audio input
-        audio_input_chat.stop_recording(
-            process_audio_input,
-            inputs=[audio_input_chat, text_input_chat, chatbot_interface, conversation_state],
-            outputs=[chatbot_interface, conversation_state],
-        ).then(
-            generate_audio_response,
-            inputs=[chatbot_interface, ref_audio_chat, ref_text_chat, remove_silence_chat],
-            outputs=[audio_output_chat, ref_text_chat],
-        ).then(
-            lambda: None,
-            None,
-            audio_input_chat,
-        )
-
-        # Handle text input
-        text_input_chat.submit(
-            process_audio_input,
-            inputs=[audio_input_chat, text_input_chat, chatbot_interface, conversation_state],
+                show_info=print,
+            ):
+                # Sent as 16-bit PCM, half the size of float32, and without Gradio rescaling each chunk to its own peak
+                sr, audio_data = audio_chunk
+                yield (sr, float_to_pcm16(audio_data)), gr.update(value=ref_text_out)
+
+        def clear_conversation(system_prompt, request: gr.Request):
+            """Reset the conversation, keeping the current system prompt"""
+            chat_caches.pop(request.session_hash, None)
+            return [], [{"role": "system", "content": system_prompt}]
+
+        # Handle audio input, text input and send button. A message sent while the previous one is still
+        # being answered is ignored, and the spoken responses of all users share one pool of GPU slots, as
+        # many as the streams tts_batcher samples together
+        gr.on(
+            triggers=[audio_input_chat.stop_recording, text_input_chat.submit, send_btn_chat.click],
+            fn=process_audio_input,
+            inputs=[
+                audio_input_chat,
+                text_input_chat,
+                chatbot_interface,
+                conversation_state,
+                system_prompt_chat,
+                ref_audio_chat,
+                ref_text_chat,
+            ],
             outputs=[chatbot_interface, conversation_state],
+            trigger_mode="once",
+            show_progress="hidden",
         ).then(
             generate_audio_response,
             inputs=[chatbot_interface, ref_audio_chat, ref_text_chat, remove_silence_chat],
             outputs=[audio_output_chat, ref_text_chat],
+            show_progress="hidden",
+            concurrency_id="tts_gpu",
+            concurrency_limit=tts_batcher.max_batch_size,
         ).then(
-            lambda: None,
+            lambda: (None, None),
             None,
-            text_input_chat,
-        )
-
-        # Handle send button
-        send_btn_chat.click(
-            process_audio_input,
-            inputs=[audio_input_chat, text_input_chat, chatbot_interface, conversation_state],
-            outputs=[chatbot_interface, conversation_state],
-        ).then(
-            generate_audio_response,
-            inputs=[chatbot_interface, ref_audio_chat, ref_text_chat, remove_silence_chat],
-            outputs=[audio_output_chat, ref_text_chat],
-        ).then(
-            lambda: None,
-            None,
-            text_input_chat,
+            [audio_input_chat, text_input_chat],
+            show_progress="hidden",
         )
 
         # Handle clear button
         clear_btn_chat.click(
             clear_conversation,
-            outputs=[chatbot_interface, conversation_state],
-        )
-
-        # Handle system prompt change and reset conversation
-        system_prompt_chat.change(
-            update_system_prompt,
             inputs=system_prompt_chat,
             outputs=[chatbot_interface, conversation_state],
         )
@@ -832,33 +1370,54 @@ If you're having issues, try converting your reference audio to WAV or MP3, clip
     )
 
     last_used_custom = files("f5_tts").joinpath("infer/.cache/last_used_custom.txt")
+    last_used_custom.parent.mkdir(parents=True, exist_ok=True)
 
     def load_last_used_custom():
         try:
-            with open(last_used_custom, "r") as f:
-                return f.read().split(",")
+            return last_used_custom.read_text().split(",")
         except FileNotFoundError:
-            last_used_custom.parent.mkdir(parents=True, exist_ok=True)
             return [
                 "hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors",
                 "hf://SWivid/F5-TTS/F5TTS_Base/vocab.txt",
             ]
 
-    def switch_tts_model(new_choice):
-        global tts_model_choice
-        if new_choice == "Custom":  # override in case webpage is refreshed
-            custom_ckpt_path, custom_vocab_path = load_last_used_custom()
-            tts_model_choice = ["Custom", custom_ckpt_path, custom_vocab_path]
-            return gr.update(visible=True, value=custom_ckpt_path), gr.update(visible=True, value=custom_vocab_path)
-        else:
-            tts_model_choice = new_choice
-            return gr.update(visible=False), gr.update(visible=False)
+    # Last used custom model, read once and only written back to disk when the app exits
+    last_used_ckpt_path, last_used_vocab_path = load_last_used_custom()
+    last_used_custom_state = {"ckpt": last_used_ckpt_path, "vocab": last_used_vocab_path, "dirty": False}
+
+    def flush_last_used_custom():
+        if not last_used_custom_state["dirty"]:
+            return
+        # Write to a temporary file first so that the file is never left half-written
+        tmp_path = last_used_custom.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(f"{last_used_custom_state['ckpt']},{last_used_custom_state['vocab']}")
+        os.replace(tmp_path, last_used_custom)
+        last_used_custom_state["dirty"] = False
+
+    # Showing the custom model dropdowns is done in the browser, the backend only records the choice
+    show_custom_model_js = """
+    (choice) => {
+        const update = {__type__: "update", visible: choice === "Custom"};
+        return [update, update];
+    }
+    """
 
-    def set_custom_model(custom_ckpt_path, custom_vocab_path):
-        global tts_model_choice
-        tts_model_choice = ["Custom", custom_ckpt_path, custom_vocab_path]
-        with open(last_used_custom, "w") as f:
-            f.write(f"{custom_ckpt_path},{custom_vocab_path}")
+    def set_custom_model(custom_ckpt_path, custom_vocab_path, request: gr.Request):
+        tts_model_choices[request.session_hash] = ["Custom", custom_ckpt_path, custom_vocab_path]
+        last_used_custom_state.update(ckpt=custom_ckpt_path, vocab=custom_vocab_path, dirty=True)
+
+    def switch_tts_model(new_choice, custom_ckpt_path, custom_vocab_path, request: gr.Request):
+        if new_choice == "Custom":
+            # the dropdowns hold the last used model as of this page load (or the user's edit of it);
+            # choosing it makes it the last used one again, as changing the dropdowns does
+            set_custom_model(
+                custom_ckpt_path or last_used_custom_state["ckpt"],
+                custom_vocab_path or last_used_custom_state["vocab"],
+                request,
+            )
+        else:
+            tts_model_choices[request.session_hash] = new_choice
 
     with gr.Row():
         if not USING_SPACES:
@@ -871,24 +1430,32 @@ If you're having issues, try converting your reference audio to WAV or MP3, clip
             )
         custom_ckpt_path = gr.Dropdown(
             choices=["hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors"],
-            value=load_last_used_custom()[0],
+            # read on every page load, so that a refreshed page shows the last used model
+            value=lambda: last_used_custom_state["ckpt"],
             allow_custom_value=True,
             label="MODEL CKPT: local_path | hf://user_id/repo_id/model_ckpt",
             visible=False,
         )
         custom_vocab_path = gr.Dropdown(
             choices=["hf://SWivid/F5-TTS/F5TTS_Base/vocab.txt"],
-            value=load_last_used_custom()[1],
+            value=lambda: last_used_custom_state["vocab"],
             allow_custom_value=True,
             label="VOCAB FILE: local_path | hf://user_id/repo_id/vocab_file",
             visible=False,
         )
 
     choose_tts_model.change(
-        switch_tts_model,
+        None,
         inputs=[choose_tts_model],
         outputs=[custom_ckpt_path, custom_vocab_path],
+        js=show_custom_model_js,
+        queue=False,
+    )
+    choose_tts_model.change(
+        switch_tts_model,
+        inputs=[choose_tts_model, custom_ckpt_path, custom_vocab_path],
         show_progress="hidden",
+        queue=False,
     )
     custom_ckpt_path.change(
         set_custom_model,
@@ -906,29 +1473,86 @@ If you're having issues, try converting your reference audio to WAV or MP3, clip
         ["Basic-TTS", "Multi-Speech", "Voice-Chat", "Credits"],
     )
 
-
-@click.command()
-@click.option("--port", "-p", default=None, type=int, help="Port to run the app on")
-@click.option("--host", "-H", default=None, help="Host to run the app on")
-@click.option(
-    "--share",
-    "-s",
-    default=False,
-    is_flag=True,
-    help="Share the app via Gradio share link",
-)
-@click.option("--api", "-a", default=True, is_flag=True, help="Allow API access")
-@click.option(
-    "--root_path",
-    "-r",
-    default=None,
-    type=str,
-    help='The root path (or "mount point") of the application, if it\'s not served from the root ("/") of the domain. Often used when the application is behind a reverse proxy that forwards requests to the application, e.g. set "/myapp" or full URL for application served at "https://example.com/myapp".',
-)
-def main(port, host, share, api, root_path):
-    global app
+    def forget_session(request: gr.Request):
+        tts_model_choices.pop(request.session_hash, None)
+        chat_caches.pop(request.session_hash, None)
+
+    app.unload(forget_session)
+
+
+def main():
+    global F5TTS_ema_model, tts_dtype, max_custom_ema_models
+    parser = argparse.ArgumentParser(description="Gradio app for E2/F5 TTS, multi-style generation and voice chat.")
+    parser.add_argument("--port", "-p", type=int, default=None, help="Port to run the app on")
+    parser.add_argument("--host", "-H", default=None, help="Host to run the app on")
+    parser.add_argument("--share", "-s", action="store_true", help="Share the app via Gradio share link")
+    parser.add_argument("--api", "-a", action="store_true", default=True, help="Allow API access")
+    parser.add_argument(
+        "--root_path",
+        "-r",
+        type=str,
+        default=None,
+        help='The root path (or "mount point") of the application, if it\'s not served from the root ("/") of the domain. Often used when the application is behind a reverse proxy that forwards requests to the application, e.g. set "/myapp" or full URL for application served at "https://example.com/myapp".',
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Number of requests of each event processed at once (default: 2 per GPU, at least 2)",
+    )
+    parser.add_argument("--queue_size", type=int, default=64, help="Maximum number of requests waiting in the queue")
+    parser.add_argument(
+        "--no_warmup", action="store_true", help="Do not load and warm up the TTS model while the app starts"
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=list(TTS_DTYPES),
+        default=None,
+        help="Dtype of the TTS model weights, e.g. fp32 to debug accuracy (default: bf16 on Ampere or newer GPUs, else fp16 on GPU)",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=["none", "gzip", "br"],
+        default="none",
+        help="Compress the app responses (mostly the frontend JS on first load); br needs brotli-asgi",
+    )
+    parser.add_argument(
+        "--model_cache_size",
+        type=int,
+        default=1,
+        help="Number of custom TTS models kept loaded, to switch between them without reloading",
+    )
+    args = parser.parse_args()
+    if args.dtype is not None:
+        tts_dtype = TTS_DTYPES[args.dtype]
+    max_custom_ema_models = max(1, args.model_cache_size)
+    # Under torchrun, every process holds a shard of F5-TTS; rank 0 serves the app and the others
+    # follow its sample calls
+    rank, world_size = init_tensor_parallel()
+    if world_size > 1:
+        F5TTS_ema_model = load_f5tts()
+        if rank > 0:
+            tensor_parallel_worker(F5TTS_ema_model)
+            return
+        broadcast_sample_calls(F5TTS_ema_model)
+        atexit.register(stop_tensor_parallel_workers)
+    concurrency = args.concurrency
+    if concurrency is None:
+        concurrency = max(2, torch.cuda.device_count() * 2)
+    # Save the last used custom model on exit, including when stopped with SIGTERM (e.g. docker stop)
+    atexit.register(flush_last_used_custom)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    if not args.no_warmup:
+        threading.Thread(target=warmup_tts, daemon=True).start()
     print("Starting app...")
-    app.queue(api_open=api).launch(server_name=host, server_port=port, share=share, show_api=api, root_path=root_path)
+    app.queue(api_open=args.api, default_concurrency_limit=concurrency, max_size=args.queue_size).launch(
+        server_name=args.host,
+        server_port=args.port,
+        share=args.share,
+        show_api=args.api,
+        root_path=args.root_path,
+        app_kwargs={"middleware": compression_middleware(args.compress)},
+    )
 
 
 if __name__ == "__main__":
@@ -936,4 +1560,3 @@ if __name__ == "__main__":
         main()
     else:
         app_tts.launch(share=True, inbrowser=True, debug=True)
-
@@ -3,33 +3,44 @@
 import os
 import sys
 
+
 os.environ["PYTOCH_ENABLE_MPS_FALLBACK"] = "1"  # for MPS device compatibility
 sys.path.append(f"../../{os.path.dirname(os.path.abspath(__file__))}/third_party/BigVGAN/")
 
 import hashlib
+import queue
+import random
 import re
+import struct
 import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from importlib.resources import files
 
 import matplotlib
 
+
 matplotlib.use("Agg")
 
 import matplotlib.pylab as plt
 import numpy as np
 import torch
-import torchaudio
+import torch.distributed as dist
+import torch.multiprocessing as mp
 import tqdm
-from huggingface_hub import snapshot_download, hf_hub_download
-from pydub import AudioSegment, silence
-from transformers import pipeline
-from vocos import Vocos
+from huggingface_hub import hf_hub_download
+from huggingface_hub import snapshot_download
+from pydub import AudioSegment
+from pydub import silence
+from torch.nn.utils.rnn import pad_sequence
 
 from f5_tts.model import CFM
-from f5_tts.model.utils import (
-    get_tokenizer,
-    convert_char_to_pinyin,
-)
+from f5_tts.model.modules import AttnProcessor
+from f5_tts.model.utils import convert_char_to_pinyin
+from f5_tts.model.utils import get_tokenizer
+
 
 _ref_audio_cache = {}
 
@@ -92,6 +103,8 @@ def chunk_text(text, max_chars=135):
 # load vocoder
 def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=device, hf_cache_dir=None):
     if vocoder_name == "vocos":
+        from vocos import Vocos
+
         # vocoder = Vocos.from_pretrained("charactr/vocos-mel-24khz").to(device)
         if is_local:
             print(f"Load vocos from local path {local_path}")
@@ -134,6 +147,9 @@ def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=dev
 # load asr pipeline
 
 asr_pipe = None
+# held while the pipeline is loaded, so that concurrent transcriptions (e.g. a prefetched reference
+# and a recorded message) load it only once
+asr_pipe_lock = threading.Lock()
 
 
 def initialize_asr_pipeline(device: str = device, dtype=None):
@@ -145,6 +161,8 @@ def initialize_asr_pipeline(device: str = device, dtype=None):
             and not torch.cuda.get_device_name().endswith("[ZLUDA]")
             else torch.float32
         )
+    from transformers import pipeline
+
     global asr_pipe
     asr_pipe = pipeline(
         "automatic-speech-recognition",
@@ -158,9 +176,10 @@ def initialize_asr_pipeline(device: str = device, dtype=None):
 
 
 def transcribe(ref_audio, language=None):
-    global asr_pipe
     if asr_pipe is None:
-        initialize_asr_pipeline(device=device)
+        with asr_pipe_lock:
+            if asr_pipe is None:
+                initialize_asr_pipeline(device=device)
     return asr_pipe(
         ref_audio,
         chunk_length_s=30,
@@ -226,6 +245,7 @@ def load_model(
     ode_method=ode_method,
     use_ema=True,
     device=device,
+    dtype=None,
 ):
     if vocab_file == "":
         vocab_file = str(files("f5_tts").joinpath("infer/examples/vocab.txt"))
@@ -252,7 +272,8 @@ def load_model(
         vocab_char_map=vocab_char_map,
     ).to(device)
 
-    dtype = torch.float32 if mel_spec_type == "bigvgan" else None
+    if dtype is None and mel_spec_type == "bigvgan":
+        dtype = torch.float32
     model = load_checkpoint(model, ckpt_path, device, dtype=dtype, use_ema=use_ema)
 
     return model
@@ -277,8 +298,8 @@ def remove_silence_edges(audio, silence_threshold=-42):
 # preprocess reference audio and text
 
 
-def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, device=device):
-    print("Converting audio...")
+def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=device):
+    show_info("Converting audio...")
     with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
         aseg = AudioSegment.from_file(ref_audio_orig)
 
@@ -290,7 +311,7 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, device=
             non_silent_wave = AudioSegment.silent(duration=0)
             for non_silent_seg in non_silent_segs:
                 if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
-                    print("Audio is over 15s, clipping short. (1)")
+                    show_info("Audio is over 15s, clipping short. (1)")
                     break
                 non_silent_wave += non_silent_seg
 
@@ -302,7 +323,7 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, device=
                 non_silent_wave = AudioSegment.silent(duration=0)
                 for non_silent_seg in non_silent_segs:
                     if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
-                        print("Audio is over 15s, clipping short. (2)")
+                        show_info("Audio is over 15s, clipping short. (2)")
                         break
                     non_silent_wave += non_silent_seg
 
@@ -311,7 +332,7 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, device=
             # 3. if no proper silence found for clipping
             if len(aseg) > 15000:
                 aseg = aseg[:15000]
-                print("Audio is over 15s, clipping short. (3)")
+                show_info("Audio is over 15s, clipping short. (3)")
 
         aseg = remove_silence_edges(aseg) + AudioSegment.silent(duration=50)
         aseg.export(f.name, format="wav")
@@ -323,18 +344,17 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, device=
         audio_hash = hashlib.md5(audio_data).hexdigest()
 
     if not ref_text.strip():
-        global _ref_audio_cache
         if audio_hash in _ref_audio_cache:
             # Use cached asr transcription
-            print("Using cached reference text...")
+            show_info("Using cached reference text...")
             ref_text = _ref_audio_cache[audio_hash]
         else:
-            print("No reference text provided, transcribing reference audio...")
+            show_info("No reference text provided, transcribing reference audio...")
             ref_text = transcribe(ref_audio)
             # Cache the transcribed text (not caching custom ref_text, enabling users to do manual tweak)
             _ref_audio_cache[audio_hash] = ref_text
     else:
-        print("Using custom reference text...")
+        show_info("Using custom reference text...")
 
     # Ensure ref_text ends with a proper sentence-ending punctuation
     if not ref_text.endswith(". ") and not ref_text.endswith("。"):
@@ -348,7 +368,6 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, device=
     return ref_audio, ref_text
 
 
-
 def infer_process(
     ref_audio,
     ref_text,
@@ -356,6 +375,7 @@ def infer_process(
     model_obj,
     vocoder,
     mel_spec_type=mel_spec_type,
+    show_info=print,
     progress=tqdm,
     target_rms=target_rms,
     cross_fade_duration=cross_fade_duration,
@@ -366,6 +386,8 @@ def infer_process(
     fix_duration=fix_duration,
     device=device,
 ):
+    import torchaudio
+
     # Split the input text into batches
     audio, sr = torchaudio.load(ref_audio)
     max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
@@ -374,7 +396,7 @@ def infer_process(
         print(f"gen_text {i}", gen_text)
     print("\n")
 
-    print(f"Generating audio in {len(gen_text_batches)} batches...")
+    show_info(f"Generating audio in {len(gen_text_batches)} batches...")
     return infer_batch_process(
         (audio, sr),
         ref_text,
@@ -394,6 +416,276 @@ def infer_process(
     )
 
 
+def prepare_ref_audio(audio, sr, target_rms=target_rms, device=device):
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+
+    rms = torch.sqrt(torch.mean(torch.square(audio)))
+    if rms < target_rms:
+        audio = audio * target_rms / rms
+    if sr != target_sample_rate:
+        import torchaudio
+
+        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
+        audio = resampler(audio)
+    return audio.to(device), rms
+
+
+def prepare_batch_text(ref_text, gen_texts):
+    # Prepare the text
+    text_list = [ref_text + gen_text for gen_text in gen_texts]
+    return convert_char_to_pinyin(text_list)
+
+
+def estimate_duration(ref_audio_len, ref_text, gen_text, speed=1, fix_duration=None):
+    """Total mel frames (reference included) to sample for gen_text, from the reference speaking rate."""
+    if fix_duration is not None:
+        return int(fix_duration * target_sample_rate / hop_length)
+    ref_text_len = len(ref_text.encode("utf-8"))
+    return ref_audio_len + int(ref_audio_len / ref_text_len * len(gen_text.encode("utf-8")) / speed)
+
+
+def sample_mels(
+    audio,
+    ref_text,
+    gen_texts,
+    model_obj,
+    nfe_step=32,
+    cfg_strength=2.0,
+    sway_sampling_coef=-1,
+    speed=1,
+    fix_duration=None,
+    final_text_list=None,
+):
+    """
+    Run one sampler pass for several gen_texts sharing the same prepared reference audio.
+
+    final_text_list may be given if prepare_batch_text was already run for these texts.
+    Returns the list of generated mel spectrograms, each [1, n_mel_channels, frames] without the
+    reference part, in the order of gen_texts.
+    """
+    if final_text_list is None:
+        final_text_list = prepare_batch_text(ref_text, gen_texts)
+
+    ref_audio_len = audio.shape[-1] // hop_length
+    durations = [estimate_duration(ref_audio_len, ref_text, gen_text, speed, fix_duration) for gen_text in gen_texts]
+
+    # inference
+    with torch.inference_mode():
+        generated, _ = model_obj.sample(
+            cond=audio.repeat(len(gen_texts), 1),
+            text=final_text_list,
+            duration=torch.tensor(durations, device=audio.device, dtype=torch.long),
+            steps=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=sway_sampling_coef,
+        )
+
+        generated = generated.to(torch.float32)
+
+        # drop the reference part, and for batched items the padding up to the longest one
+        return [
+            generated[i : i + 1, ref_audio_len : duration if len(durations) > 1 else None, :].permute(0, 2, 1)
+            for i, duration in enumerate(durations)
+        ]
+
+
+def sample_mels_padded(
+    audios, ref_texts, gen_texts, durations, model_obj, nfe_step=32, cfg_strength=2.0, sway_sampling_coef=-1
+):
+    """
+    Run one sampler pass for gen_texts each with its own prepared reference audio.
+
+    The reference waves are zero-padded to the longest one and masked by their lengths. Returns the list
+    of generated mel spectrograms, each [1, n_mel_channels, frames] without the reference part.
+    """
+    ref_audio_lens = [audio.shape[-1] // hop_length for audio in audios]
+    final_text_list = convert_char_to_pinyin([ref_text + gen_text for ref_text, gen_text in zip(ref_texts, gen_texts)])
+
+    with torch.inference_mode():
+        generated, _ = model_obj.sample(
+            cond=pad_sequence([audio[0] for audio in audios], batch_first=True),
+            text=final_text_list,
+            duration=torch.tensor(durations, device=audios[0].device, dtype=torch.long),
+            lens=torch.tensor(ref_audio_lens, device=audios[0].device, dtype=torch.long),
+            steps=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=sway_sampling_coef,
+        )
+
+        generated = generated.to(torch.float32)
+        return [
+            generated[i : i + 1, ref_audio_len:duration, :].permute(0, 2, 1)
+            for i, (ref_audio_len, duration) in enumerate(zip(ref_audio_lens, durations))
+        ]
+
+
+class SampleBatcher:
+    """
+    Merge the sampler passes of concurrent requests into batched ones.
+
+    Requests are collected for up to max_wait seconds or max_batch_size requests, then grouped by model,
+    sampling settings and total mel length rounded up to bucket_frames, and each group is sampled in one
+    sample_mels_padded pass from a single background thread.
+    """
+
+    def __init__(self, max_batch_size=4, max_wait=0.03, bucket_frames=128):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.bucket_frames = bucket_frames
+        self.requests = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def sample_mel(
+        self,
+        audio,
+        ref_text,
+        gen_text,
+        model_obj,
+        nfe_step=32,
+        cfg_strength=2.0,
+        sway_sampling_coef=-1,
+        speed=1,
+        fix_duration=None,
+    ):
+        """Blocking equivalent of sample_mels for one gen_text, sampled along with the other pending requests."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        duration = estimate_duration(audio.shape[-1] // hop_length, ref_text, gen_text, speed, fix_duration)
+        future = Future()
+        self.requests.put(
+            (future, audio, ref_text, gen_text, duration, model_obj, (nfe_step, cfg_strength, sway_sampling_coef))
+        )
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for request in batch:
+                _, _, _, _, duration, model_obj, settings = request
+                key = (id(model_obj), settings, -(-duration // self.bucket_frames))
+                groups.setdefault(key, []).append(request)
+
+            for group in groups.values():
+                futures, audios, ref_texts, gen_texts, durations, model_objs, settings = zip(*group)
+                try:
+                    mels = sample_mels_padded(audios, ref_texts, gen_texts, durations, model_objs[0], *settings[0])
+                except Exception as e:  # noqa: BLE001 - raised again in the requests waiting on them
+                    for future in futures:
+                        future.set_exception(e)
+                else:
+                    for future, mel in zip(futures, mels):
+                        future.set_result(mel)
+
+
+def sample_batch(
+    audio,
+    rms,
+    ref_text,
+    gen_texts,
+    model_obj,
+    vocoder,
+    mel_spec_type="vocos",
+    target_rms=0.1,
+    nfe_step=32,
+    cfg_strength=2.0,
+    sway_sampling_coef=-1,
+    speed=1,
+    fix_duration=None,
+    final_text_list=None,
+):
+    """
+    Run sample_mels and vocode each generated mel spectrogram.
+
+    Returns the list of generated waves and the list of mel spectrograms, in the order of gen_texts.
+    """
+    generated_mel_specs = sample_mels(
+        audio,
+        ref_text,
+        gen_texts,
+        model_obj,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        sway_sampling_coef=sway_sampling_coef,
+        speed=speed,
+        fix_duration=fix_duration,
+        final_text_list=final_text_list,
+    )
+
+    generated_waves = []
+    spectrograms = []
+
+    with torch.inference_mode():
+        for generated_mel_spec in generated_mel_specs:
+            if mel_spec_type == "vocos":
+                generated_wave = vocoder.decode(generated_mel_spec)
+            elif mel_spec_type == "bigvgan":
+                generated_wave = vocoder(generated_mel_spec)
+            if rms < target_rms:
+                generated_wave = generated_wave * rms / target_rms
+
+            # wav -> numpy
+            generated_waves.append(generated_wave.squeeze().cpu().numpy())
+            spectrograms.append(generated_mel_spec[0].cpu().numpy())
+
+    return generated_waves, spectrograms
+
+
+def cross_fade_waves(generated_waves, cross_fade_duration=0.15):
+    # Combine all generated waves with cross-fading
+    if cross_fade_duration <= 0:
+        # Simply concatenate
+        return np.concatenate(generated_waves)
+
+    final_wave = generated_waves[0]
+    for i in range(1, len(generated_waves)):
+        prev_wave = final_wave
+        next_wave = generated_waves[i]
+
+        # Calculate cross-fade samples, ensuring it does not exceed wave lengths
+        cross_fade_samples = int(cross_fade_duration * target_sample_rate)
+        cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
+
+        if cross_fade_samples <= 0:
+            # No overlap possible, concatenate
+            final_wave = np.concatenate([prev_wave, next_wave])
+            continue
+
+        # Overlapping parts
+        prev_overlap = prev_wave[-cross_fade_samples:]
+        next_overlap = next_wave[:cross_fade_samples]
+
+        # Fade out and fade in
+        fade_out = np.linspace(1, 0, cross_fade_samples)
+        fade_in = np.linspace(0, 1, cross_fade_samples)
+
+        # Cross-faded overlap
+        cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
+
+        # Combine
+        new_wave = np.concatenate(
+            [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
+        )
+
+        final_wave = new_wave
+
+    return final_wave
+
+
 def infer_batch_process(
     ref_audio,
     ref_text,
@@ -411,17 +703,7 @@ def infer_batch_process(
     fix_duration=None,
     device=None,
 ):
-    audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
-
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
+    audio, rms = prepare_ref_audio(*ref_audio, target_rms=target_rms, device=device)
 
     generated_waves = []
     spectrograms = []
@@ -429,87 +711,585 @@ def infer_batch_process(
     if len(ref_text[-1].encode("utf-8")) == 1:
         ref_text = ref_text + " "
     for i, gen_text in enumerate(progress.tqdm(gen_text_batches)):
-        # Prepare the text
-        text_list = [ref_text + gen_text]
-        final_text_list = convert_char_to_pinyin(text_list)
+        waves, mels = sample_batch(
+            audio,
+            rms,
+            ref_text,
+            [gen_text],
+            model_obj,
+            vocoder,
+            mel_spec_type=mel_spec_type,
+            target_rms=target_rms,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            fix_duration=fix_duration,
+        )
+        generated_waves.extend(waves)
+        spectrograms.extend(mels)
 
-        ref_audio_len = audio.shape[-1] // hop_length
-        if fix_duration is not None:
-            duration = int(fix_duration * target_sample_rate / hop_length)
-        else:
-            # Calculate duration
-            ref_text_len = len(ref_text.encode("utf-8"))
-            gen_text_len = len(gen_text.encode("utf-8"))
-            duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / speed)
+    final_wave = cross_fade_waves(generated_waves, cross_fade_duration)
+
+    # Create a combined spectrogram
+    combined_spectrogram = np.concatenate(spectrograms, axis=1)
+
+    return final_wave, target_sample_rate, combined_spectrogram
+
+
+# stream the audio of a text while it is synthesized, vocoding each mel spectrogram block by block
 
-        # inference
+
+def decode_mel_blocks(mel, vocoder, mel_spec_type="vocos", block_frames=40, context_frames=8):
+    """
+    Vocode mel [1, n_mel_channels, frames] block_frames at a time, yielding each block's wave as it is decoded.
+
+    Each block is decoded along with up to context_frames of mel on both sides, whose samples are then
+    dropped, so that the blocks join without the artifacts of decoding them in isolation.
+    """
+    frames = mel.shape[-1]
+    for start in range(0, frames, block_frames):
+        end = min(start + block_frames, frames)
+        context_start, context_end = max(start - context_frames, 0), min(end + context_frames, frames)
         with torch.inference_mode():
-            generated, _ = model_obj.sample(
-                cond=audio,
-                text=final_text_list,
-                duration=duration,
-                steps=nfe_step,
+            block = mel[:, :, context_start:context_end]
+            if mel_spec_type == "vocos":
+                wave = vocoder.decode(block)
+            elif mel_spec_type == "bigvgan":
+                wave = vocoder(block)
+            wave = wave.squeeze(0).squeeze(0).cpu().numpy()
+        samples_per_frame = len(wave) / (context_end - context_start)
+        wave_start = round((start - context_start) * samples_per_frame)
+        wave_end = round((end - context_start) * samples_per_frame)
+        yield wave[wave_start:wave_end]
+
+
+class CUDAGraphVocoder:
+    """
+    Vocos vocoder whose decode of a mel block of one fixed length is compiled and captured in a CUDA graph.
+
+    Blocks of that length (the interior blocks of decode_mel_blocks, with their context on both sides)
+    are copied into a static input and decoded by replaying the graph; any other block is decoded eagerly.
+    """
+
+    def __init__(self, vocoder, frames, warmup_passes=3, device=device):
+        self.vocoder = vocoder
+        self.lock = threading.Lock()
+        decode = torch.compile(vocoder.decode, fullgraph=True)
+        self.static_mel = torch.zeros(1, n_mel_channels, frames, device=device)
+        with torch.inference_mode():
+            # compile and warm up on a side stream, as required before capturing
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(warmup_passes):
+                    decode(self.static_mel)
+            torch.cuda.current_stream().wait_stream(stream)
+            self.graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self.graph):
+                self.static_wave = decode(self.static_mel)
+
+    def decode(self, mel):
+        if mel.shape != self.static_mel.shape:
+            return self.vocoder.decode(mel)
+        # the static tensors are shared, so only one block goes through the graph at a time
+        with self.lock:
+            self.static_mel.copy_(mel)
+            self.graph.replay()
+            return self.static_wave.clone()
+
+    def __getattr__(self, name):
+        return getattr(self.vocoder, name)
+
+
+def infer_process_stream(
+    ref_audio,
+    ref_text,
+    gen_text,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    show_info=print,
+    target_rms=target_rms,
+    cross_fade_duration=cross_fade_duration,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    sway_sampling_coef=sway_sampling_coef,
+    speed=speed,
+    fix_duration=fix_duration,
+    device=device,
+    block_frames=40,
+    batcher=None,
+):
+    """
+    Streaming variant of infer_process, yielding the final wave piece by piece.
+
+    The text batches are sampled one after the other, and the mel spectrogram of each is vocoded
+    block_frames at a time (40 frames, about 0.5 s). The end of each batch is held back until the
+    next one starts, to cross-fade them as infer_process does. If a SampleBatcher is given, the
+    batches are sampled through it, along with those of concurrent streams.
+    """
+    import torchaudio
+
+    # Split the input text into batches
+    audio, sr = torchaudio.load(ref_audio)
+    max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+    gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
+    show_info(f"Generating audio in {len(gen_text_batches)} batches...")
+
+    audio, rms = prepare_ref_audio(audio, sr, target_rms=target_rms, device=device)
+    if len(ref_text[-1].encode("utf-8")) == 1:
+        ref_text = ref_text + " "
+
+    cross_fade_samples = max(int(cross_fade_duration * target_sample_rate), 0)
+    # audio of the previous batches not yielded yet, to be cross-faded with the start of the next batch
+    tail = None
+    for batch_text in gen_text_batches:
+        if batcher is not None:
+            generated_mel_spec = batcher.sample_mel(
+                audio,
+                ref_text,
+                batch_text,
+                model_obj,
+                nfe_step=nfe_step,
                 cfg_strength=cfg_strength,
                 sway_sampling_coef=sway_sampling_coef,
+                speed=speed,
+                fix_duration=fix_duration,
+            )
+        else:
+            (generated_mel_spec,) = sample_mels(
+                audio,
+                ref_text,
+                [batch_text],
+                model_obj,
+                nfe_step=nfe_step,
+                cfg_strength=cfg_strength,
+                sway_sampling_coef=sway_sampling_coef,
+                speed=speed,
+                fix_duration=fix_duration,
             )
 
-            generated = generated.to(torch.float32)
-            generated = generated[:, ref_audio_len:, :]
-            generated_mel_spec = generated.permute(0, 2, 1)
-            if mel_spec_type == "vocos":
-                generated_wave = vocoder.decode(generated_mel_spec)
-            elif mel_spec_type == "bigvgan":
-                generated_wave = vocoder(generated_mel_spec)
+        wave = np.zeros(0, dtype=np.float32)
+        fade_samples = 0 if tail is None else min(cross_fade_samples, len(tail))
+        faded = fade_samples == 0
+        for block_wave in decode_mel_blocks(generated_mel_spec, vocoder, mel_spec_type, block_frames=block_frames):
             if rms < target_rms:
-                generated_wave = generated_wave * rms / target_rms
+                block_wave = block_wave * rms.item() / target_rms
+            wave = np.concatenate([wave, block_wave])
+            if not faded and len(wave) >= fade_samples:
+                wave = cross_fade_waves([tail, wave], cross_fade_duration)
+                faded = True
+            if faded and len(wave) > cross_fade_samples:
+                yield wave[: len(wave) - cross_fade_samples]
+                wave = wave[len(wave) - cross_fade_samples :]
+        if not faded:
+            # this batch is shorter than the cross-fade
+            wave = cross_fade_waves([tail, wave], cross_fade_duration)
+        tail = wave
 
-            # wav -> numpy
-            generated_wave = generated_wave.squeeze().cpu().numpy()
+    if tail is not None and len(tail):
+        yield tail
 
-            generated_waves.append(generated_wave)
-            spectrograms.append(generated_mel_spec[0].cpu().numpy())
 
-    # Combine all generated waves with cross-fading
-    if cross_fade_duration <= 0:
-        # Simply concatenate
-        final_wave = np.concatenate(generated_waves)
-    else:
-        final_wave = generated_waves[0]
-        for i in range(1, len(generated_waves)):
-            prev_wave = final_wave
-            next_wave = generated_waves[i]
-
-            # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-            cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-            cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
-
-            if cross_fade_samples <= 0:
-                # No overlap possible, concatenate
-                final_wave = np.concatenate([prev_wave, next_wave])
-                continue
-
-            # Overlapping parts
-            prev_overlap = prev_wave[-cross_fade_samples:]
-            next_overlap = next_wave[:cross_fade_samples]
-
-            # Fade out and fade in
-            fade_out = np.linspace(1, 0, cross_fade_samples)
-            fade_in = np.linspace(0, 1, cross_fade_samples)
-
-            # Cross-faded overlap
-            cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
-
-            # Combine
-            new_wave = np.concatenate(
-                [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
+# synthesize several independent texts with one reference, batching the sampler across them
+
+
+def infer_multi_process_iter(
+    ref_audio,
+    ref_text,
+    gen_texts,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    show_info=print,
+    progress=tqdm,
+    target_rms=target_rms,
+    cross_fade_duration=cross_fade_duration,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    sway_sampling_coef=sway_sampling_coef,
+    speed=speed,
+    fix_duration=fix_duration,
+    batch_size=4,
+    device=device,
+):
+    """
+    Batched counterpart of infer_process for a list of gen_texts sharing one reference.
+
+    Every gen_text is chunked as in infer_process, then all chunks are sorted by length and sampled
+    batch_size at a time so that chunks of similar duration share a padded sampler pass. The text of
+    the next batch is prepared on a worker thread while the current one is sampled. As soon as all
+    chunks of a gen_text are sampled, they are stitched back together and yielded, so callers can
+    consume finished texts while the next batches are sampled.
+
+    Yields:
+        tuple: (index in gen_texts, final wave, combined spectrogram), in completion order.
+    """
+    import torchaudio
+
+    audio, sr = torchaudio.load(ref_audio)
+    max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+    chunks = [
+        (text_idx, chunk) for text_idx, gen_text in enumerate(gen_texts) for chunk in chunk_text(gen_text, max_chars)
+    ]
+    # bucket chunks of similar length together to minimize padding
+    order = sorted(range(len(chunks)), key=lambda i: len(chunks[i][1].encode("utf-8")))
+    buckets = [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+    show_info(f"Generating audio for {len(gen_texts)} texts in {len(buckets)} batches...")
+    if not buckets:
+        return
+    audio, rms = prepare_ref_audio(audio, sr, target_rms=target_rms, device=device)
+    if len(ref_text[-1].encode("utf-8")) == 1:
+        ref_text = ref_text + " "
+
+    chunk_waves = [None] * len(chunks)
+    chunk_mels = [None] * len(chunks)
+    remaining = [0] * len(gen_texts)
+    for text_idx, _ in chunks:
+        remaining[text_idx] += 1
+
+    with ThreadPoolExecutor(max_workers=1) as text_executor:
+        next_text = text_executor.submit(prepare_batch_text, ref_text, [chunks[i][1] for i in buckets[0]])
+        for bucket_idx, bucket in enumerate(progress.tqdm(buckets)):
+            final_text_list = next_text.result()
+            if bucket_idx + 1 < len(buckets):
+                next_texts = [chunks[i][1] for i in buckets[bucket_idx + 1]]
+                next_text = text_executor.submit(prepare_batch_text, ref_text, next_texts)
+            waves, mels = sample_batch(
+                audio,
+                rms,
+                ref_text,
+                [chunks[i][1] for i in bucket],
+                model_obj,
+                vocoder,
+                mel_spec_type=mel_spec_type,
+                target_rms=target_rms,
+                nfe_step=nfe_step,
+                cfg_strength=cfg_strength,
+                sway_sampling_coef=sway_sampling_coef,
+                speed=speed,
+                fix_duration=fix_duration,
+                final_text_list=final_text_list,
             )
+            for i, wave, mel in zip(bucket, waves, mels):
+                chunk_waves[i] = wave
+                chunk_mels[i] = mel
+                text_idx = chunks[i][0]
+                remaining[text_idx] -= 1
+                if remaining[text_idx] == 0:
+                    idxs = [j for j, (chunk_text_idx, _) in enumerate(chunks) if chunk_text_idx == text_idx]
+                    final_wave = cross_fade_waves([chunk_waves[j] for j in idxs], cross_fade_duration)
+                    spectrogram = np.concatenate([chunk_mels[j] for j in idxs], axis=1)
+                    for j in idxs:
+                        chunk_waves[j] = chunk_mels[j] = None
+                    yield text_idx, final_wave, spectrogram
+
+
+def infer_multi_process(ref_audio, ref_text, gen_texts, model_obj, vocoder, **kwargs):
+    """
+    Run infer_multi_process_iter to completion.
 
-            final_wave = new_wave
+    Returns:
+        tuple:
+            - list[numpy.ndarray]: Final wave for each gen_text, in input order.
+            - int: Sample rate of the generated waves.
+            - list[numpy.ndarray]: Combined spectrogram for each gen_text, in input order.
+    """
+    final_waves = [None] * len(gen_texts)
+    spectrograms = [None] * len(gen_texts)
+    for text_idx, final_wave, spectrogram in infer_multi_process_iter(
+        ref_audio, ref_text, gen_texts, model_obj, vocoder, **kwargs
+    ):
+        final_waves[text_idx] = final_wave
+        spectrograms[text_idx] = spectrogram
+    return final_waves, target_sample_rate, spectrograms
 
-    # Create a combined spectrogram
-    combined_spectrogram = np.concatenate(spectrograms, axis=1)
 
-    return final_wave, target_sample_rate, combined_spectrogram
+# synthesize and save several texts with one reference, sharded across all visible GPUs
+
+
+def _load_worker_model(model_spec, dtype, compile_model, device):
+    model_cls, model_cfg, ckpt_path, vocab_file = model_spec
+    model_obj = load_model(model_cls, model_cfg, ckpt_path, vocab_file=vocab_file, device=device, dtype=dtype)
+    if compile_model:
+        try:
+            model_obj.transformer = torch.compile(model_obj.transformer, dynamic=True)
+        except Exception as e:  # noqa: BLE001 - compilation is an optimization, eager mode always works
+            print(f"Could not compile TTS model, using eager mode: {e}")
+    return model_obj
+
+
+def _multi_gpu_worker(rank, jobs, results):
+    device = f"cuda:{rank}"
+    torch.cuda.set_device(device)
+    vocoder = load_vocoder(device=device)
+    # only the model of the latest job is kept, so that a worker holds a single model at a time
+    model_key, model_obj = None, None
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        model_spec, dtype, compile_model, ref_audio, ref_text, gen_texts, idxs, file_paths, kwargs = job
+        try:
+            if model_key != (model_spec, dtype, compile_model):
+                model_key, model_obj = None, None
+                torch.cuda.empty_cache()
+                model_obj = _load_worker_model(model_spec, dtype, compile_model, device)
+                model_key = (model_spec, dtype, compile_model)
+
+            remove_silence = kwargs.pop("remove_silence", False)
+            final_waves, final_sample_rate, _ = infer_multi_process(
+                ref_audio,
+                ref_text,
+                [gen_texts[i] for i in idxs],
+                model_obj,
+                vocoder,
+                show_info=lambda msg: results.put(("message", f"[GPU {rank}] {msg}")),
+                device=device,
+                **kwargs,
+            )
+            for i, wave in zip(idxs, final_waves):
+                if remove_silence:
+                    wave = remove_silence_for_generated_wav_array(wave, final_sample_rate)
+                write_wav_pcm16(file_paths[i], wave, final_sample_rate)
+                results.put(("message", f"[GPU {rank}] Saved {file_paths[i]}"))
+            results.put(("done", None))
+        except Exception as e:  # noqa: BLE001 - reported back to the caller, the worker serves the next jobs
+            results.put(("done", f"[GPU {rank}] {e}"))
+
+
+class MultiGPUWorkerPool:
+    """
+    One persistent worker process per visible GPU, each keeping its vocoder and the last model it used loaded.
+
+    Jobs are run one at a time: a job shards its texts across all the workers and waits for all of them.
+    The worker on GPU 0 loads its own copy of the model, so a process already using GPU 0 (e.g. the
+    gradio app) needs room there for both.
+    """
+
+    def __init__(self):
+        context = mp.get_context("spawn")
+        self.world_size = torch.cuda.device_count()
+        self.results = context.Queue()
+        self.jobs = [context.Queue() for _ in range(self.world_size)]
+        self.processes = [
+            context.Process(target=_multi_gpu_worker, args=(rank, self.jobs[rank], self.results), daemon=True)
+            for rank in range(self.world_size)
+        ]
+        # spawn runs the __main__ module again in every worker (as __mp_main__), which for the gradio app
+        # would build its whole UI; the workers only need this module, so they are started with it as main
+        main_module = sys.modules["__main__"]
+        sys.modules["__main__"] = sys.modules[__name__]
+        try:
+            for process in self.processes:
+                process.start()
+        finally:
+            sys.modules["__main__"] = main_module
+        self.lock = threading.Lock()
+
+    def alive(self):
+        return all(process.is_alive() for process in self.processes)
+
+    def run(self, model_spec, dtype, compile_model, ref_audio, ref_text, gen_texts, file_paths, show_info, kwargs):
+        with self.lock:
+            for rank in range(self.world_size):
+                idxs = list(range(rank, len(gen_texts), self.world_size))
+                self.jobs[rank].put(
+                    (model_spec, dtype, compile_model, ref_audio, ref_text, gen_texts, idxs, file_paths, dict(kwargs))
+                )
+            errors = []
+            pending = self.world_size
+            while pending:
+                try:
+                    kind, value = self.results.get(timeout=0.5)
+                except queue.Empty:
+                    if not self.alive():
+                        raise RuntimeError("A multi-GPU worker process died")
+                    continue
+                if kind == "message":
+                    show_info(value)
+                else:
+                    pending -= 1
+                    if value is not None:
+                        errors.append(value)
+            if errors:
+                raise RuntimeError("; ".join(errors))
+
+
+_multi_gpu_pool = None
+_multi_gpu_pool_lock = threading.Lock()
+
+
+def infer_multi_gpu(
+    ref_audio,
+    ref_text,
+    gen_texts,
+    model_spec,
+    file_paths,
+    show_info=print,
+    dtype=None,
+    compile_model=False,
+    **kwargs,
+):
+    """
+    Synthesize gen_texts[i] into file_paths[i], sharding the texts across all visible GPUs.
+
+    The work goes to a MultiGPUWorkerPool started on first use, whose workers load the model described by
+    model_spec = (model_cls, model_cfg, ckpt_path, vocab_file) in dtype (compiled if compile_model) and keep
+    it for the next calls. Each handles gen_texts[rank::world_size] through infer_multi_process and writes
+    the waves itself; only progress messages are sent back and forwarded to show_info. Extra kwargs go to
+    infer_multi_process, except remove_silence which is applied to each wave before writing.
+    """
+    global _multi_gpu_pool
+    with _multi_gpu_pool_lock:
+        # started again if a worker died (e.g. out of memory)
+        if _multi_gpu_pool is None or not _multi_gpu_pool.alive():
+            _multi_gpu_pool = MultiGPUWorkerPool()
+    _multi_gpu_pool.run(model_spec, dtype, compile_model, ref_audio, ref_text, gen_texts, file_paths, show_info, kwargs)
+
+
+# tensor parallel DiT, splitting the heads and feed-forward of every block across the GPUs of a torchrun launch
+
+
+def init_tensor_parallel():
+    """Join the process group when launched by torchrun with several processes, returning (rank, world_size)."""
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size == 1:
+        return 0, 1
+    if not dist.is_initialized():
+        torch.cuda.set_device(int(os.environ["LOCAL_RANK"]))
+        dist.init_process_group("nccl")
+    return dist.get_rank(), world_size
+
+
+def tensor_parallel_world_size():
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+class ShardedAttnProcessor(AttnProcessor):
+    """
+    AttnProcessor for the heads of a tensor parallel Attention held by one rank.
+
+    The rotary embedding only covers the first dim_head features of the projections, i.e. the first
+    head, which is held by rank 0.
+    """
+
+    def __init__(self, rank):
+        super().__init__()
+        self.rank = rank
+
+    def __call__(self, attn, x, mask=None, rope=None):
+        return super().__call__(attn, x, mask=mask, rope=rope if self.rank == 0 else None)
+
+
+def shard_dit_tensor_parallel(model_obj):
+    """
+    Shard the DiT blocks of model_obj across the process group, Megatron style.
+
+    q/k/v and the feed-forward input are split column-wise (by head / hidden unit), the attention output
+    and feed-forward output row-wise, so each block costs two all-reduces. Every rank must call this,
+    and then run the same sample calls (see broadcast_sample_calls and tensor_parallel_worker).
+    """
+    from torch.distributed.device_mesh import init_device_mesh
+    from torch.distributed.tensor.parallel import ColwiseParallel
+    from torch.distributed.tensor.parallel import RowwiseParallel
+    from torch.distributed.tensor.parallel import parallelize_module
+
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    mesh = init_device_mesh("cuda", (world_size,))
+    for block in model_obj.transformer.transformer_blocks:
+        assert block.attn.heads % world_size == 0, f"{block.attn.heads} heads cannot be split across {world_size} GPUs"
+        parallelize_module(
+            block,
+            mesh,
+            {
+                "attn.to_q": ColwiseParallel(),
+                "attn.to_k": ColwiseParallel(),
+                "attn.to_v": ColwiseParallel(),
+                "attn.to_out.0": RowwiseParallel(),
+                "ff.ff.0.0": ColwiseParallel(),
+                "ff.ff.2": RowwiseParallel(),
+            },
+        )
+        block.attn.heads //= world_size
+        block.attn.processor = ShardedAttnProcessor(rank)
+    return model_obj
+
+
+def _move_tensors(obj, device):
+    if torch.is_tensor(obj):
+        return obj.to(device)
+    if isinstance(obj, dict):
+        return {key: _move_tensors(value, device) for key, value in obj.items()}
+    return obj
+
+
+# held on rank 0 from broadcasting a sample call until it has run, so that the collectives of concurrent
+# calls (request handlers, batcher, warmup) do not interleave and leave the ranks waiting on different ones
+tensor_parallel_lock = threading.Lock()
+
+
+def broadcast_sample_calls(model_obj):
+    """On rank 0, make model_obj.sample send its arguments to the tensor_parallel_worker of the other ranks first."""
+    sample = model_obj.sample
+
+    def broadcast_sample(cond, text, duration, **kwargs):
+        # the initial noise has to be the same on every rank
+        seed = random.randint(0, 2**31 - 1)
+        worker_kwargs = {key: value for key, value in kwargs.items() if key != "vocoder"}
+        call = (
+            seed,
+            _move_tensors(cond, "cpu"),
+            text,
+            _move_tensors(duration, "cpu"),
+            _move_tensors(worker_kwargs, "cpu"),
+        )
+        with tensor_parallel_lock:
+            dist.broadcast_object_list([call], src=0)
+            torch.manual_seed(seed)
+            return sample(cond, text, duration, **kwargs)
+
+    model_obj.sample = broadcast_sample
+    return model_obj
+
+
+def tensor_parallel_worker(model_obj):
+    """On the other ranks, run the sample calls broadcast by rank 0 until stop_tensor_parallel_workers."""
+    while True:
+        call = [None]
+        dist.broadcast_object_list(call, src=0)
+        if call[0] is None:
+            return
+        seed, cond, text, duration, kwargs = call[0]
+        torch.manual_seed(seed)
+        model_obj.sample(
+            _move_tensors(cond, model_obj.device),
+            text,
+            _move_tensors(duration, model_obj.device),
+            **_move_tensors(kwargs, model_obj.device),
+        )
+
+
+def stop_tensor_parallel_workers():
+    with tensor_parallel_lock:
+        dist.broadcast_object_list([None], src=0)
+        dist.destroy_process_group()
+
+
+# quantize a float wave to 16-bit PCM
+
+pcm16_scale = 32768  # full scale of int16 samples, for conversions in both directions
+
+
+def float_to_pcm16(wave):
+    """Quantize a float wave in [-1, 1] to int16, scaling, rounding and clipping in place in one float32 buffer."""
+    pcm = np.array(wave, dtype=np.float32)
+    pcm *= pcm16_scale
+    np.rint(pcm, out=pcm)
+    np.clip(pcm, -pcm16_scale, pcm16_scale - 1, out=pcm)
+    return pcm.astype(np.int16)
 
 
 # remove silence from generated wav
@@ -527,6 +1307,57 @@ def remove_silence_for_generated_wav(filename):
     aseg.export(filename, format="wav")
 
 
+def remove_silence_for_generated_wav_array(wav, sr):
+    """In-memory variant of remove_silence_for_generated_wav, for a float wave in [-1, 1]."""
+    pcm = float_to_pcm16(wav)
+    aseg = AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=sr, channels=1)
+    non_silent_segs = silence.split_on_silence(
+        aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10
+    )
+    non_silent_wave = AudioSegment.silent(duration=0, frame_rate=sr)
+    for non_silent_seg in non_silent_segs:
+        non_silent_wave += non_silent_seg
+    return np.array(non_silent_wave.get_array_of_samples(), dtype=np.float32) / pcm16_scale
+
+
+# write a mono float wave as a 16-bit PCM wav file
+
+
+def write_wav_pcm16(path, wave, sr):
+    """Write a mono float wave in [-1, 1] with a single header + data write, skipping libsndfile."""
+    pcm = float_to_pcm16(wave).astype("<i2", copy=False)
+    data_size = pcm.nbytes
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,  # fmt chunk size
+        1,  # PCM
+        1,  # mono
+        sr,
+        sr * 2,  # byte rate
+        2,  # block align
+        16,  # bits per sample
+        b"data",
+        data_size,
+    )
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        if hasattr(os, "writev"):
+            written = os.writev(fd, [header, pcm])
+        else:  # Windows
+            written = os.write(fd, header)
+        # finish whatever a single call did not write
+        if written < len(header) + data_size:
+            remaining = memoryview(header + pcm.tobytes())[written:]
+            while remaining:
+                remaining = remaining[os.write(fd, remaining) :]
+    finally:
+        os.close(fd)
+
+
 # save spectrogram
 
 
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+
+pytest.importorskip("gradio")
+
+
+@pytest.fixture(scope="module")
+def render_chat_suffix(tmp_path_factory):
+    # importing the app creates its output directory in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        from f5_tts.infer.infer.ifgjs import render_chat_suffix
+    finally:
+        os.chdir(cwd)
+    return render_chat_suffix
+
+
+class FakeTokenizer:
+    """Chat template rendering every message on its own, as the Qwen templates do."""
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        text = "".join(f"<|{message['role']}|>{message['content']}<|end|>\n" for message in messages)
+        return text + "<|assistant|>" if add_generation_prompt else text
+
+
+class TrailingTokenizer(FakeTokenizer):
+    """Chat template closing the whole conversation, so that a message renders differently once followed."""
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        return (
+            "<|start|>" + super().apply_chat_template(messages, add_generation_prompt=add_generation_prompt) + "<|eot|>"
+        )
+
+
+MESSAGES = [
+    {"role": "system", "content": "Stay in character."},
+    {"role": "user", "content": "Hello"},
+    {"role": "assistant", "content": "Hi there"},
+]
+NEW_MESSAGES = [{"role": "user", "content": "How are you?"}]
+
+
+@pytest.mark.parametrize("add_generation_prompt", [False, True])
+def test_render_chat_suffix_extends_the_rendered_prefix(render_chat_suffix, add_generation_prompt):
+    tokenizer = FakeTokenizer()
+    suffix = render_chat_suffix(tokenizer, MESSAGES, NEW_MESSAGES, add_generation_prompt=add_generation_prompt)
+    assert tokenizer.apply_chat_template(MESSAGES) + suffix == tokenizer.apply_chat_template(
+        MESSAGES + NEW_MESSAGES, add_generation_prompt=add_generation_prompt
+    )
+
+
+def test_render_chat_suffix_rejects_templates_not_rendering_messages_independently(render_chat_suffix):
+    assert render_chat_suffix(TrailingTokenizer(), MESSAGES, NEW_MESSAGES) is None
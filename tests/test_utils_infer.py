@@ -0,0 +1,186 @@
+import threading
+import wave
+
+import numpy as np
+import pytest
+import torch
+
+from f5_tts.infer import utils_infer
+from f5_tts.infer.utils_infer import SampleBatcher
+from f5_tts.infer.utils_infer import cross_fade_waves
+from f5_tts.infer.utils_infer import decode_mel_blocks
+from f5_tts.infer.utils_infer import float_to_pcm16
+from f5_tts.infer.utils_infer import hop_length
+from f5_tts.infer.utils_infer import target_sample_rate
+from f5_tts.infer.utils_infer import write_wav_pcm16
+
+
+# float_to_pcm16 / write_wav_pcm16
+
+
+def test_float_to_pcm16_clips_to_the_int16_range():
+    pcm = float_to_pcm16(np.array([0.0, 1.0, -1.0, 2.0, -2.0]))
+    assert pcm.dtype == np.int16
+    assert pcm.tolist() == [0, 32767, -32768, 32767, -32768]
+
+
+def test_float_to_pcm16_rounds_to_nearest():
+    wave_in = np.array([1.6, -1.6, 0.4, -0.4], dtype=np.float32) / 32768
+    assert float_to_pcm16(wave_in).tolist() == [2, -2, 0, 0]
+
+
+def test_float_to_pcm16_leaves_its_input_unchanged():
+    wave_in = np.array([0.25, 2.0], dtype=np.float32)
+    float_to_pcm16(wave_in)
+    assert wave_in.tolist() == [0.25, 2.0]
+
+
+def test_write_wav_pcm16_header_and_size(tmp_path):
+    wave_in = np.sin(np.linspace(0, 100, 1001)).astype(np.float32)
+    path = tmp_path / "out.wav"
+    write_wav_pcm16(path, wave_in, target_sample_rate)
+
+    data = path.read_bytes()
+    assert len(data) == 44 + 2 * len(wave_in)
+    assert data[:4] == b"RIFF" and int.from_bytes(data[4:8], "little") == len(data) - 8
+    with wave.open(str(path), "rb") as f:
+        assert f.getnchannels() == 1
+        assert f.getsampwidth() == 2
+        assert f.getframerate() == target_sample_rate
+        assert f.getnframes() == len(wave_in)
+        assert f.readframes(f.getnframes()) == float_to_pcm16(wave_in).astype("<i2").tobytes()
+
+
+# cross_fade_waves
+
+
+def test_cross_fade_waves_without_cross_fade_concatenates():
+    waves = [np.ones(10), np.zeros(5), np.full(3, 2.0)]
+    np.testing.assert_array_equal(cross_fade_waves(waves, 0), np.concatenate(waves))
+
+
+def test_cross_fade_waves_overlaps_consecutive_waves():
+    samples = int(0.01 * target_sample_rate)
+    waves = [np.ones(3 * samples), np.zeros(2 * samples)]
+    final_wave = cross_fade_waves(waves, 0.01)
+    assert len(final_wave) == 5 * samples - samples
+    np.testing.assert_array_equal(final_wave[: 2 * samples], 1)
+    np.testing.assert_allclose(final_wave[2 * samples : 3 * samples], np.linspace(1, 0, samples))
+    np.testing.assert_array_equal(final_wave[3 * samples :], 0)
+
+
+def test_cross_fade_waves_overlap_is_limited_to_the_shorter_wave():
+    waves = [np.ones(100), np.ones(10)]
+    assert len(cross_fade_waves(waves, 1.0)) == 100
+
+
+# decode_mel_blocks
+
+
+class RepeatVocoder:
+    """Decodes each mel frame to samples_per_frame copies of its first channel, recording the block lengths."""
+
+    def __init__(self, samples_per_frame):
+        self.samples_per_frame = samples_per_frame
+        self.block_frames = []
+
+    def decode(self, mel):
+        self.block_frames.append(mel.shape[-1])
+        return mel[:, 0, :].repeat_interleave(self.samples_per_frame, dim=-1)
+
+
+@pytest.mark.parametrize("frames", [1, 39, 40, 100, 120])
+def test_decode_mel_blocks_joins_into_the_whole_wave(frames):
+    mel = torch.arange(frames, dtype=torch.float32).expand(1, 2, frames)
+    vocoder = RepeatVocoder(samples_per_frame=4)
+    blocks = list(decode_mel_blocks(mel, vocoder, block_frames=40, context_frames=8))
+
+    assert [len(block) for block in blocks] == [4 * min(40, frames - start) for start in range(0, frames, 40)]
+    np.testing.assert_array_equal(np.concatenate(blocks), np.repeat(np.arange(frames), 4))
+    # every block is decoded with up to 8 frames of context on both sides
+    assert vocoder.block_frames == [min(start + 48, frames) - max(start - 8, 0) for start in range(0, frames, 40)]
+
+
+# SampleBatcher
+
+
+@pytest.fixture
+def sample_calls(monkeypatch):
+    """Replace sample_mels_padded by a fake returning the gen_texts as "mels", recording the batches."""
+    calls = []
+
+    def fake_sample_mels_padded(audios, ref_texts, gen_texts, durations, model_obj, *settings):
+        calls.append((model_obj, settings, list(gen_texts)))
+        if "fail" in gen_texts:
+            raise RuntimeError("sampling failed")
+        return list(gen_texts)
+
+    monkeypatch.setattr(utils_infer, "sample_mels_padded", fake_sample_mels_padded)
+    return calls
+
+
+def sample_concurrently(batcher, requests):
+    """Call batcher.sample_mel for each (gen_text, model_obj, nfe_step) from its own thread."""
+    audio = np.zeros((1, 100 * hop_length))
+    results = [None] * len(requests)
+
+    def sample(i, gen_text, model_obj, nfe_step):
+        try:
+            results[i] = batcher.sample_mel(audio, "a" * 10, gen_text, model_obj, nfe_step=nfe_step)
+        except RuntimeError as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=sample, args=(i, *request)) for i, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_sample_batcher_merges_concurrent_requests(sample_calls):
+    batcher = SampleBatcher(max_batch_size=4, max_wait=0.5)
+    model_obj = object()
+    results = sample_concurrently(batcher, [("b" * 10, model_obj, 32), ("c" * 10, model_obj, 32)])
+
+    assert results == ["b" * 10, "c" * 10]
+    assert len(sample_calls) == 1
+    assert sorted(sample_calls[0][2]) == ["b" * 10, "c" * 10]
+
+
+def test_sample_batcher_groups_by_model_settings_and_length(sample_calls):
+    batcher = SampleBatcher(max_batch_size=8, max_wait=0.5)
+    model_a, model_b = object(), object()
+    requests = [
+        ("b" * 10, model_a, 32),
+        ("c" * 10, model_a, 32),
+        ("d" * 10, model_b, 32),  # other model
+        ("e" * 10, model_a, 16),  # other settings
+        ("f" * 200, model_a, 32),  # other length bucket
+    ]
+    results = sample_concurrently(batcher, requests)
+
+    assert results == [gen_text for gen_text, _, _ in requests]
+    batches = sorted(sorted(gen_texts) for _, _, gen_texts in sample_calls)
+    assert batches == [["b" * 10, "c" * 10], ["d" * 10], ["e" * 10], ["f" * 200]]
+    for model_obj, settings, gen_texts in sample_calls:
+        for gen_text, request_model_obj, nfe_step in requests:
+            if gen_text in gen_texts:
+                assert model_obj is request_model_obj and settings[0] == nfe_step
+
+
+def test_sample_batcher_splits_at_max_batch_size(sample_calls):
+    batcher = SampleBatcher(max_batch_size=2, max_wait=0.5)
+    model_obj = object()
+    requests = [(gen_text * 10, model_obj, 32) for gen_text in "bcde"]
+    results = sample_concurrently(batcher, requests)
+
+    assert results == [gen_text for gen_text, _, _ in requests]
+    assert all(len(gen_texts) <= 2 for _, _, gen_texts in sample_calls)
+    assert sorted(gen_text for _, _, gen_texts in sample_calls for gen_text in gen_texts) == sorted(results)
+
+
+def test_sample_batcher_raises_sampling_errors_in_the_requests(sample_calls):
+    batcher = SampleBatcher(max_batch_size=4, max_wait=0.5)
+    (result,) = sample_concurrently(batcher, [("fail", object(), 32)])
+    assert isinstance(result, RuntimeError)